@@ -0,0 +1,247 @@
+"""
+    Rocket angle solver.
+
+    Finds the angle (pitch) and yaw to shoot a rocket at, which maximizes one of
+        'height'    the highest z the soldier reaches
+        'speed'     the highest horizontal speed of the soldier
+        'distance'  the horizontal distance from the start to where the soldier lands after being hit
+
+    The soldier is simulated from its current state with the given inputs, and
+    +attack is pressed after fire_tick (same as in the examples). The angle and yaw
+    are changed after fire_tick as well, so the soldier moves the same way up
+    until the rocket is fired.
+
+    Candidates are first estimated in vectorized batches, without simulating the whole run
+      1. The soldier is simulated once without shooting. This gives the state of the
+         soldier on every tick, which does not depend on the angle.
+      2. All candidate rockets are fired at once using Batch_soldier.shoot_rocket,
+         and moved with Batch_soldier.move_rockets until they explode (only the rockets are simulated)
+      3. The knockback of every explosion is computed using batch_simulation.knockback_kernel,
+         on the state of the soldier at the explosion tick
+      4. The objective is estimated from the velocity after the knockback, assuming
+         the soldier flies ballistically afterwards
+    The best estimates are then verified with the scalar simulation, and the search
+    is repeated on a finer grid around the best verified candidate.
+
+    Usage
+        p = simulation.Soldier(simulation.Key_state(), launcher=simulation.Original())
+        ctap = [(7, '+jump', 1.0), (7, '+duck', 1.0), (8, '+jump', 0.0), (8, '+duck', 0.0)]
+        result = Aim_solver(p, fire_tick = 5, inputs = ctap, objective = 'height').solve()
+        print(result.angle, result.value)
+
+        # A grounded shot for distance, about -59 for a standing soldier
+        p = simulation.Soldier(simulation.Key_state(), launcher=simulation.Original(), b_on_ground=True)
+        result = Aim_solver(p, fire_tick = 5, objective = 'distance').solve()
+
+    Note: The estimates assume that the yaw does not change how the soldier moves after the shot,
+          and ignore rockets that were already flying. The verified values are exact.
+"""
+
+from collections import namedtuple
+from math import atan2, cos, degrees, radians, sin, sqrt
+
+import numpy as np
+
+import simulation
+from simulation import sv_gravity
+from batch_simulation import Batch_soldier, knockback_kernel
+from input_script import Timeline
+
+objectives = ('height', 'speed', 'distance')
+
+# value is the exact (verified) value of the objective, estimate is the vectorized estimate
+Aim_result = namedtuple('Aim_result', ['angle', 'yaw', 'value', 'estimate'])
+
+def yaw_vectors(yaw):
+    yaw = radians(yaw)
+    return [cos(yaw), sin(yaw)], [sin(yaw), -cos(yaw)]
+
+# The state of the soldier that Batch_soldier needs, one row per tick
+state_fields = ('pos', 'vel', 'b_ducked', 'b_on_ground', 'z_eye_offset', 'forward_2D', 'right_2D')
+
+class Aim_solver:
+    def __init__(self, soldier, fire_tick, inputs = (), ticks = 300, objective = 'height', launcher = None):
+        if objective not in objectives:
+            raise ValueError('unknown objective %s, expected one of %s' % (objective, ', '.join(objectives)))
+        self.soldier = soldier
+        self.fire_tick = fire_tick
+        self.inputs = list(inputs)
+        self.ticks = ticks
+        self.objective = objective
+        self.launcher = soldier.launcher if launcher is None else launcher
+        if isinstance(self.launcher, type):
+            self.launcher = self.launcher()
+        self.start = soldier.snapshot()
+        self.start_keys = soldier.key_state.snapshot()
+        self.baseline = None
+
+    @property
+    def yaw(self):
+        return degrees(atan2(self.soldier.forward_2D[1], self.soldier.forward_2D[0]))
+
+    # Runs the soldier through the inputs. If angle is not None, a rocket is fired with angle and yaw.
+    # Calls record(tick) after every tick. The soldier is restored afterwards.
+    def run(self, angle = None, yaw = None, record = None):
+        soldier = self.soldier
+        inputs = self.inputs
+        if angle is not None:
+            inputs = inputs + [(self.fire_tick, 'angle', angle), (self.fire_tick, '+attack', 1.0), (self.fire_tick + 1, '+attack', 0.0)]
+        timeline = Timeline(inputs)
+        launcher = soldier.launcher
+        soldier.launcher = self.launcher
+        try:
+            timeline.apply(soldier, -1)
+            for tick in range(self.ticks):
+                if tick == self.fire_tick + 1 and yaw is not None:
+                    soldier.forward_2D, soldier.right_2D = yaw_vectors(yaw)
+                soldier.simulate_tick()
+                timeline.apply(soldier, tick)
+                if record: record(tick)
+        finally:
+            soldier.launcher = launcher
+            soldier.restore(self.start)
+            soldier.key_state.restore(self.start_keys)
+
+    def record_baseline(self):
+        soldier = self.soldier
+        rows = {name : [] for name in state_fields}
+        rows['floor_z'] = []
+        def record(tick):
+            for name in state_fields:
+                value = getattr(soldier, name)
+                rows[name].append(list(value) if isinstance(value, list) else value)
+            rows['floor_z'].append(soldier.floor.z)
+        self.run(record = record)
+        self.baseline = {name : np.array(values) for name, values in rows.items()}
+
+    # A batch with the baseline state of the soldier after each of the given ticks
+    def batch(self, ticks):
+        states = {name : values[ticks] for name, values in self.baseline.items()}
+        batch = Batch_soldier(self.soldier.key_state, states['pos'], launcher = self.launcher,
+                soldier_class = type(self.soldier), vel = states['vel'], b_ducked = states['b_ducked'],
+                b_on_ground = states['b_on_ground'], floor_z = states['floor_z'],
+                forward_2D = states['forward_2D'], right_2D = states['right_2D'])
+        # Note: Same as in Batch_soldier.from_soldiers
+        batch.pos = np.array(states['pos'], dtype=float)
+        batch.z_eye_offset = np.array(states['z_eye_offset'], dtype=float)
+        return batch
+
+    # Estimates of the objective for every pair angles[i], yaws[i]. -inf if the rocket does not hit the soldier.
+    def estimate(self, angles, yaws):
+        if self.baseline is None:
+            self.record_baseline()
+        angles = np.asarray(angles, dtype=float)
+        yaws = np.asarray(yaws, dtype=float)
+        n = len(angles)
+        estimates = np.full(n, -np.inf)
+        # The rocket is fired during tick fire_tick + 1
+        shot_tick = self.fire_tick + 1
+        if n == 0 or shot_tick >= self.ticks:
+            return estimates
+
+        shooter = self.batch(np.full(n, shot_tick))
+        shooter.angle = angles
+        yaw = np.radians(yaws)
+        shooter.forward_2D = np.stack([np.cos(yaw), np.sin(yaw)], axis=1)
+        shooter.right_2D = np.stack([np.sin(yaw), -np.cos(yaw)], axis=1)
+        shooter.shoot_rocket(np.arange(n))
+
+        # Move the rockets until they explode. Every soldier of shooter has a single rocket
+        explosion_tick = np.full(n, -1)
+        explosion_pos = np.zeros((n, 3))
+        for tick in range(shot_tick + 1, self.ticks):
+            if not len(shooter.rocket_owner):
+                break
+            owner, pos = shooter.move_rockets()
+            explosion_pos[owner] = pos
+            explosion_tick[owner] = tick
+
+        hit = np.flatnonzero(explosion_tick >= 0)
+        if not len(hit):
+            return estimates
+        states = {name : values[explosion_tick[hit]] for name, values in self.baseline.items()}
+        rocket_type = self.launcher.rocket_type
+        delta_vel, in_range = knockback_kernel(explosion_pos[hit], rocket_type.explosion_damage, rocket_type.explosion_radius,
+                states['pos'], states['b_ducked'], states['b_on_ground'], type(self.soldier))
+        hit = hit[in_range]
+        pos, floor_z = states['pos'][in_range], states['floor_z'][in_range]
+        vel = states['vel'][in_range] + delta_vel[in_range]
+
+        vz = np.maximum(vel[:, 2], 0.0)
+        hspeed = np.hypot(vel[:, 0], vel[:, 1])
+        if self.objective == 'height':
+            estimates[hit] = pos[:, 2] + vz * vz / (2.0 * sv_gravity)
+        elif self.objective == 'speed':
+            estimates[hit] = hspeed
+        else:
+            # Time until falling back down to the floor
+            airtime = (vel[:, 2] + np.sqrt(vel[:, 2] ** 2 + 2.0 * sv_gravity * np.maximum(pos[:, 2] - floor_z, 0.0))) / sv_gravity
+            start = np.array(self.start[0][:2])
+            landing = pos[:, :2] + vel[:, :2] * airtime[:, None]
+            estimates[hit] = np.hypot(*(landing - start).T)
+        return estimates
+
+    # The exact value of the objective, using the scalar simulation
+    def measure(self, angle, yaw):
+        soldier = self.soldier
+        start = self.start[0]
+        best = [-np.inf]
+        state = {'hit' : False, 'airborne' : False, 'landed' : False}
+
+        after_hit = soldier.dispatch.soldier_after_hit
+        def soldier_after_hit(*args):
+            state['hit'] = True
+            if after_hit: after_hit(*args)
+        soldier.dispatch.soldier_after_hit = soldier_after_hit
+
+        def record(tick):
+            if self.objective == 'height':
+                best[0] = max(best[0], soldier.pos[2])
+            elif self.objective == 'speed':
+                if state['hit']:
+                    best[0] = max(best[0], sqrt(soldier.vel[0] * soldier.vel[0] + soldier.vel[1] * soldier.vel[1]))
+            elif state['hit'] and not state['landed']:
+                # A soldier hit on the ground only leaves the ground on a later tick
+                if not soldier.b_on_ground:
+                    state['airborne'] = True
+                if (state['airborne'] and soldier.b_on_ground) or tick == self.ticks - 1:
+                    state['landed'] = True
+                    best[0] = sqrt((soldier.pos[0] - start[0]) ** 2 + (soldier.pos[1] - start[1]) ** 2)
+        try:
+            self.run(angle, yaw, record)
+        finally:
+            soldier.hook = soldier.hook # Rebuilds the dispatch
+        return best[0]
+
+    # Searches a grid of angles and yaws, verifies the top best estimates, and repeats
+    # rounds times on a finer grid around the best verified candidate
+    def solve(self, angles = None, yaws = None, top = 8, rounds = 3):
+        if angles is None:
+            angles = np.arange(simulation.min_angle, simulation.max_angle + 0.5, 1.0)
+        if yaws is None:
+            yaws = [self.yaw]
+        angles = np.asarray(angles, dtype=float)
+        yaws = np.asarray(yaws, dtype=float)
+        angle_step = np.diff(np.unique(angles)).min() if len(np.unique(angles)) > 1 else 0.0
+        yaw_step = np.diff(np.unique(yaws)).min() if len(np.unique(yaws)) > 1 else 0.0
+
+        best = None
+        for _ in range(rounds):
+            grid_angles, grid_yaws = [x.ravel() for x in np.meshgrid(angles, yaws)]
+            estimates = self.estimate(grid_angles, grid_yaws)
+            order = np.argsort(-estimates, kind='stable')[:top]
+            for i in order:
+                if estimates[i] == -np.inf:
+                    break
+                angle, yaw = float(grid_angles[i]), float(grid_yaws[i])
+                value = self.measure(angle, yaw)
+                if best is None or value > best.value:
+                    best = Aim_result(angle, yaw, value, float(estimates[i]))
+            if best is None:
+                break
+            # Finer grid around the best candidate so far
+            angle_step /= 4
+            yaw_step /= 4
+            angles = np.clip(best.angle + angle_step * np.arange(-4, 5), simulation.min_angle, simulation.max_angle)
+            yaws = best.yaw + yaw_step * np.arange(-4, 5) if yaw_step else np.array([best.yaw])
+        return best
@@ -0,0 +1,640 @@
+"""
+    Batched soldier simulation using numpy.
+
+    Simulates many soldiers at the same time, all driven by the same Key_state.
+    This is intended for sweeps where one input script is replayed against
+    many different starting positions/velocities (e.g. bounce checking).
+
+    Every soldier is stored as one row in a set of numpy arrays ("struct of arrays").
+    The branches of Player.simulate_tick and Soldier.simulate_tick are evaluated
+    using masks. Each operation is done in the same order as in simulation.py,
+    so the results are bit-identical to simulating each soldier by itself.
+
+    Note: Hooks are not supported. Use Batch_soldier.to_soldier(i) to continue
+          simulating a single soldier with hooks.
+    Note: Every soldier has its own floor, given by floor_z. Rockets use the
+          floor of the soldier at the time they were fired.
+    Note: The values of +duck and +jump in the Key_state may also be arrays
+          with one value per soldier, e.g. key_state.press_key('+jump', mask * 1.0).
+"""
+
+import math
+import numpy as np
+
+import simulation
+from simulation import (
+    tick_duration, max_vel, jump_speed,
+    sv_accelerate, sv_airaccelerate, sv_friction, sv_gravity, sv_stopspeed, sv_stepsize,
+    cl_forwardspeed, cl_backspeed, cl_sidespeed, cl_upspeed,
+    COORD_RESOLUTION, AIRSPEEDCAP, WISHSPEEDTHR,
+    tf_clamp_back_speed_min, tf_clamp_back_speed, BUNNYJUMP_MAX_SPEED_FACTOR,
+    AIRDUCK_LIMIT, REDUCK_TIME, DUCKING_TIME, UNDUCKING_TIME,
+)
+
+"""
+    Vectorized versions of the math functions in simulation.py
+"""
+
+def round_to_nearest_float(x):
+    # Same as simulation.round_to_nearest_float, but for numpy arrays
+    # Within the range of normal floats, casting to float32 and back does the rounding
+    x = np.asarray(x, dtype=float)
+    with np.errstate(over='ignore'):
+        rounded = x.astype(np.float32).astype(float)
+    magnitude = np.abs(x)
+    special = ~((simulation.FLT_MIN <= magnitude) & (magnitude <= simulation.FLT_MAX)) & (x != 0)
+    if special.any():
+        rounded[special] = round_to_nearest_float_frexp(x[special])
+    return rounded
+
+def round_to_nearest_float_frexp(x):
+    # Same as simulation.round_to_nearest_float_frexp, but for numpy arrays
+    m, e = np.frexp(x)
+    m = np.round(m * 2**24) / 2**24
+    return np.copysign(np.ldexp(m, e), x)
+
+# x**n for every element, using the pow of python floats
+# Note: simulation.py squares using x**2, which calls pow() of the C library. That is not
+#       correctly rounded, so neither x * x nor numpy's power always give the same result.
+python_pow = np.frompyfunc(pow, 2, 1)
+
+def power(x, n):
+    return np.asarray(python_pow(np.asarray(x, dtype=float), float(n)), dtype=float)
+
+def simplespline(x):
+    return 3 * power(x, 2) - 2 * power(x, 3)
+
+# Length of each row in an (..., k) array
+# Note: Summed left to right to match simulation.length
+def length(v):
+    squares = power(v, 2)
+    total = squares[..., 0]
+    for i in range(1, v.shape[-1]):
+        total = total + squares[..., i]
+    return np.sqrt(total)
+
+"""
+    Knockback kernel.
+
+    Soldier.simulate_knockback for many explosions and soldiers at once. All arguments
+    are broadcast together, explosion_pos and pos have an extra last axis of length 3.
+    For example, every explosion against every soldier is
+
+        delta_vel, hit = knockback_kernel(explosion_pos[:, None], explosion_damage[:, None], explosion_radius[:, None],
+                                          pos[None, :], b_ducked[None, :], b_on_ground[None, :])
+
+    which gives delta_vel of shape (explosions, soldiers, 3) and hit of shape (explosions, soldiers).
+    The soldier moves with vel + delta_vel where hit is True, which is bit-identical to
+    Soldier.simulate_knockback. delta_vel is 0 where hit is False.
+"""
+
+def knockback_kernel(explosion_pos, explosion_damage, explosion_radius, pos, b_ducked, b_on_ground, soldier_class = simulation.Soldier):
+    explosion_pos = np.asarray(explosion_pos, dtype=float)
+    pos = np.asarray(pos, dtype=float)
+    b_ducked = np.asarray(b_ducked, dtype=bool)
+    b_on_ground = np.asarray(b_on_ground, dtype=bool)
+    explosion_damage = np.asarray(explosion_damage, dtype=float)
+    explosion_radius = np.asarray(explosion_radius, dtype=float)
+
+    # Check if explosion is within explosion radius
+    # This is done by checking if closest point in bounding box is within
+    # the radius
+    center_pos = pos.copy()
+    center_pos[..., 2] += np.where(b_ducked, 31.0, 41.0)
+    # Note: simulation.Soldier uses the ducked bounding box for standing players as well
+    bbox = np.array(soldier_class.ducked_bounding_box)
+
+    bbox_min = center_pos - bbox/2
+    bbox_max = center_pos + bbox/2
+
+    closet_point = np.clip(explosion_pos, bbox_min, bbox_max)
+    dist_rocket_to_bbox = length(closet_point - explosion_pos)
+    hit = ~(dist_rocket_to_bbox > explosion_radius)
+
+    # Damage is computed using min distance to feet or center
+    dist_rocket_to_center = length(center_pos - explosion_pos)
+    dist_rocket_to_feet = length(pos - explosion_pos)
+
+    d = np.minimum(dist_rocket_to_center, dist_rocket_to_feet)
+    inital_damage = explosion_damage * (1.0 - 0.5 * np.minimum(d / explosion_radius, 1.0))
+
+    # Note what is called modified damage here is not actual damage
+    modified_damage = inital_damage * np.where(b_on_ground, 5.0, 6.0)
+    modified_damage = np.where(b_ducked, modified_damage * (82/55), modified_damage)
+    modified_damage = np.minimum(modified_damage, 1000.0)
+
+    # Move explosion 10.0 units down
+    explosion_pos = explosion_pos.copy()
+    explosion_pos[..., 2] -= 10.0
+
+    explosion_dir = center_pos - explosion_pos
+    with np.errstate(divide='ignore', invalid='ignore'):
+        explosion_dir = explosion_dir / length(explosion_dir)[..., None]
+    delta_vel = np.where(hit[..., None], explosion_dir * modified_damage[..., None], 0.0)
+    return delta_vel, hit
+
+"""
+    The batched soldier class.
+"""
+
+class Batch_soldier:
+    # Per soldier arrays, with their dtype and shape of each row
+    fields = {
+        'pos' : (float, (3,)),
+        'vel' : (float, (3,)),
+        'angle' : (float, ()),
+        'b_ducked' : (bool, ()),
+        'b_ducking' : (bool, ()),
+        'b_on_ground' : (bool, ()),
+        'floor_z' : (float, ()),
+        'forward_2D' : (float, (2,)),
+        'right_2D' : (float, (2,)),
+        'grip' : (float, ()),
+        'b_crop_speed_ducking' : (bool, ()),
+        'duck_animation' : (float, ()),
+        'reduck_timer' : (float, ()),
+        'b_prev_tick_duck_pressed' : (bool, ()),
+        'airduck_counter' : (int, ()),
+        'b_prev_tick_jump_pressed' : (bool, ()),
+        'z_eye_offset' : (float, ()),
+        'fire_cooldown' : (float, ()),
+    }
+
+    def __init__(self,
+            key_state,
+            pos,
+            launcher = simulation.Stock(),
+            soldier_class = simulation.Soldier,
+
+            vel = [0., 0., 0.],
+            angle = -89.0,
+            b_ducked = False,
+            b_ducking = False,
+            b_on_ground = False,
+            floor_z = None,
+
+            forward_2D = [1., 0.],
+            right_2D = [0., -1.],
+            grip = 1.0,
+            b_crop_speed_ducking = False,
+            duck_animation = 10.0,
+            reduck_timer = 10.0,
+            b_prev_tick_duck_pressed = False,
+            airduck_counter = 0,
+            b_prev_tick_jump_pressed = False,
+            fire_cooldown = 0.0
+        ):
+        # Every argument can either be given per soldier, or be shared by all soldiers
+        self.key_state = key_state
+        self.launcher = launcher
+        self.soldier_class = soldier_class
+
+        self.pos = np.array(pos, dtype=float).reshape(-1, 3)
+        self.n = n = len(self.pos)
+
+        values = dict(locals())
+        for name, (dtype, shape) in self.fields.items():
+            if name in ('pos', 'z_eye_offset'):
+                continue
+            value = values[name]
+            if name == 'floor_z' and value is None:
+                value = self.pos[:, 2]
+            setattr(self, name, np.array(np.broadcast_to(np.asarray(value, dtype=dtype), (n,) + shape)))
+
+        # Teleport player up by 0.03125
+        self.pos[self.floor_z == self.pos[:, 2], 2] += COORD_RESOLUTION
+
+        self.z_eye_offset = np.where(self.b_ducked, soldier_class.view_height_ducked, soldier_class.view_height_standing)
+
+        # The active rockets of all soldiers, in order of creation
+        self.rocket_owner = np.zeros(0, dtype=int)
+        self.rocket_pos = np.zeros((0, 3))
+        self.rocket_vel = np.zeros((0, 3))
+        self.rocket_floor_z = np.zeros(0)
+
+    # Create a batch from a list of Soldier-objects
+    @classmethod
+    def from_soldiers(cls, key_state, soldiers):
+        launcher = soldiers[0].launcher
+        assert all(type(p.launcher) is type(launcher) for p in soldiers)
+
+        kwargs = {name : [getattr(p, name) for p in soldiers] for name in cls.fields if name not in ('floor_z', 'z_eye_offset')}
+        kwargs['floor_z'] = [p.floor.z for p in soldiers]
+        batch = cls(key_state, launcher=launcher, soldier_class=type(soldiers[0]), **kwargs)
+        # Note: __init__ may have teleported players standing exactly at the floor
+        batch.pos = np.array(kwargs['pos'], dtype=float)
+        batch.z_eye_offset = np.array([p.z_eye_offset for p in soldiers], dtype=float)
+
+        rockets = [(i, rocket) for i, p in enumerate(soldiers) for rocket in p.active_rockets]
+        if rockets:
+            batch.rocket_owner = np.array([i for i, _ in rockets], dtype=int)
+            batch.rocket_pos = np.array([rocket.pos for _, rocket in rockets], dtype=float)
+            batch.rocket_vel = np.array([rocket.vel for _, rocket in rockets], dtype=float)
+            batch.rocket_floor_z = np.array([rocket.floor.z for _, rocket in rockets], dtype=float)
+        return batch
+
+    # Create a Soldier-object with the state of soldier i
+    def to_soldier(self, i, key_state = None, hook = None):
+        p = self.soldier_class(key_state if key_state is not None else self.key_state, launcher=self.launcher)
+        for name in self.fields:
+            if name == 'floor_z':
+                continue
+            value = getattr(self, name)[i]
+            setattr(p, name, value.tolist())
+        p.floor = simulation.Floor(float(self.floor_z[i]))
+
+        rocket_type = self.launcher.rocket_type
+        for j in np.flatnonzero(self.rocket_owner == i):
+            floor = p.floor if self.rocket_floor_z[j] == p.floor.z else simulation.Floor(float(self.rocket_floor_z[j]))
+            p.rocket_scheduler.add(rocket_type(self.rocket_pos[j].tolist(), self.rocket_vel[j].tolist(), floor))
+
+        p.hook = hook
+        return p
+
+    """
+        Player movement. Mirrors the methods of simulation.Player.
+        Every method takes an array of indices of the soldiers to update.
+    """
+
+    def set_ducked_eye_offset(self, idx, fraction):
+        cls = self.soldier_class
+        self.z_eye_offset[idx] = fraction * cls.view_height_ducked + (1.0 - fraction) * cls.view_height_standing
+
+    def categorize_position(self, idx):
+        # CTFGameMovement::CategorizePosition in tf/tf_gamemovement
+        self.grip[idx] = 1.0
+        vz = self.vel[idx, 2]
+        dz = self.pos[idx, 2] - self.floor_z[idx]
+        on_ground = self.b_on_ground[idx]
+
+        up = vz > 250.0
+        stay = ~up & on_ground
+        land = ~up & ~on_ground & (dz < 2.0)
+        air = ~up & ~on_ground & ~land
+
+        # Teleport to .03125 units above floor
+        teleport = stay & (dz < 2.0 + sv_stepsize)
+        teleport_idx = idx[teleport]
+        traced_dist_to_floor = self.pos[teleport_idx, 2] - (self.floor_z[teleport_idx] + COORD_RESOLUTION)
+        teleport_idx = teleport_idx[traced_dist_to_floor > 0.5 * COORD_RESOLUTION]
+        self.pos[teleport_idx, 2] = self.floor_z[teleport_idx] + COORD_RESOLUTION
+
+        # CGameMovement::SetGroundEntity in shared/gamemovement.cpp
+        self.vel[idx[land], 2] = 0.0
+        self.b_on_ground[idx[up | air]] = False
+        self.b_on_ground[idx[stay | land]] = True
+        self.airduck_counter[idx[stay | land]] = 0
+        self.grip[idx[air & (vz > 0.0)]] = 0.25
+
+    def handle_ducking(self):
+        # CGameMovement::ReduceTimers
+        self.duck_animation += tick_duration
+        self.reduck_timer += tick_duration
+
+        b_duck_pressed = np.full(self.n, self.key_state['+duck'] > 0)
+
+        # CTFGameMovement::DuckOverrides
+        b_duck_pressed &= ~((self.reduck_timer < REDUCK_TIME) & self.b_on_ground)
+        b_duck_pressed &= ~(self.b_ducked & self.b_ducking)
+        b_duck_pressed &= ~(~self.b_on_ground & (self.airduck_counter >= AIRDUCK_LIMIT))
+
+        #CTFGameMovement::Duck
+        b_duck_just_pressed = b_duck_pressed & ~self.b_prev_tick_duck_pressed
+        b_duck_just_released = ~b_duck_pressed & self.b_prev_tick_duck_pressed
+        self.b_prev_tick_duck_pressed = b_duck_pressed
+
+        # CGameMovement::HandleDuckingSpeedCrop
+        self.b_crop_speed_ducking = self.b_ducked & self.b_on_ground
+
+        unduck = ~b_duck_pressed & (self.b_ducked | self.b_ducking)
+
+        #CTFGameMovement::OnDuck
+        start = b_duck_pressed & b_duck_just_pressed & ~self.b_ducked
+        self.duck_animation[start] = 0.0
+        self.b_ducking[start] = True
+
+        ducking = b_duck_pressed & self.b_ducking
+        done = self.duck_animation > DUCKING_TIME
+        finish_duck = np.flatnonzero(ducking & (done | self.b_ducked | ~self.b_on_ground) & ~self.b_ducked)
+        animate = np.flatnonzero(ducking & ~(done | self.b_ducked | ~self.b_on_ground))
+
+        #CGameMovement::FinishDuck
+        self.b_ducked[finish_duck] = True
+        self.b_ducking[finish_duck] = False
+        self.set_ducked_eye_offset(finish_duck, 1.0)
+        self.pos[finish_duck[~self.b_on_ground[finish_duck]], 2] += 20.0
+
+        self.set_ducked_eye_offset(animate, simplespline(self.duck_animation[animate] / DUCKING_TIME))
+
+        #CTFGameMovement::OnUnDuck
+        released = unduck & b_duck_just_released
+        self.reduck_timer[released] = 0.0
+        self.airduck_counter[released & ~self.b_on_ground] += 1
+
+        reset = released & self.b_ducked
+        reverse = released & ~self.b_ducked & self.b_ducking
+        self.duck_animation[reset] = 0.0
+        # Reverse duck animation
+        self.duck_animation[reverse] = np.maximum(0.0, DUCKING_TIME - self.duck_animation[reverse]) * UNDUCKING_TIME / DUCKING_TIME
+
+        can_unduck = self.b_on_ground | (self.pos[:, 2] - self.floor_z >= 20.0)
+        done = (self.duck_animation > UNDUCKING_TIME) | ~self.b_on_ground
+        finish_unduck = np.flatnonzero(unduck & can_unduck & done)
+        animate = np.flatnonzero(unduck & can_unduck & ~done)
+        stuck = np.flatnonzero(unduck & ~can_unduck & (self.duck_animation > 0.0))
+
+        # CGameMovement::FinishUnDuck
+        self.pos[finish_unduck[~self.b_on_ground[finish_unduck]], 2] -= 20.0
+        self.b_ducked[finish_unduck] = False
+        self.b_ducking[finish_unduck] = False
+        self.duck_animation[finish_unduck] = 10.0
+        self.set_ducked_eye_offset(finish_unduck, 0.0)
+
+        self.b_ducking[animate] = True
+        self.set_ducked_eye_offset(animate, simplespline(1.0 - self.duck_animation[animate] / UNDUCKING_TIME))
+
+        self.duck_animation[stuck] = 0.0
+        self.b_ducked[stuck] = True
+        self.b_ducking[stuck] = False
+        self.set_ducked_eye_offset(stuck, 1.0)
+
+        # Note: finish_duck and finish_unduck never overlap
+        self.categorize_position(np.concatenate((finish_duck, finish_unduck)))
+
+    #CGameMovement::PlayerMove
+    def simulate_player_tick(self):
+        vel = self.vel
+        self.b_on_ground &= ~(vel[:, 2] > 250.0)
+
+        self.handle_ducking()
+
+        # CTFGameMovement::FullWalkMove in tf/tf_gamemovement
+        half_grav = sv_gravity * 0.5 * tick_duration
+
+        # CGameMovement::StartGravity in shared/gamemovement.cpp
+        # CGameMovement::CheckVelocity in shared/gamemovement.cpp
+        vel[:, 2] = np.clip(vel[:, 2] - half_grav, -max_vel, max_vel)
+        vel[:, :2] = np.clip(vel[:, :2], -max_vel, max_vel)
+
+        b_jump_pressed = self.key_state['+jump'] > 0
+        jump = np.flatnonzero(b_jump_pressed & ~self.b_prev_tick_jump_pressed & ~self.b_ducked & self.b_on_ground)
+        self.b_prev_tick_jump_pressed[:] = b_jump_pressed
+
+        #CTFGameMovement::CheckJumpButton
+        if len(jump):
+            #CTFGameMovement::PreventBunnyJumping in tf/tf_gamemovement
+            speed = length(vel[jump])
+            bhop = speed >= BUNNYJUMP_MAX_SPEED_FACTOR * self.soldier_class.flMaxSpeed
+            scale = BUNNYJUMP_MAX_SPEED_FACTOR * self.soldier_class.flMaxSpeed / speed[bhop]
+            vel[jump[bhop]] *= scale[:, None]
+
+            self.b_on_ground[jump] = False
+
+            # This code makes little to no sense, but it is what it is
+            crouched = self.b_ducked[jump] | self.b_ducking[jump]
+            vel[jump, 2] = np.clip(np.where(crouched, jump_speed, vel[jump, 2] + jump_speed) - half_grav, -max_vel, max_vel)
+
+        ground = np.flatnonzero(self.b_on_ground)
+        air = np.flatnonzero(~self.b_on_ground)
+
+        vel[ground, 2] = 0.0
+        self.friction(ground)
+        self.walkmove(ground)
+        self.airmove(air)
+
+        self.categorize_position(np.arange(self.n))
+
+        # CGameMovement::FinishGravity in shared/gamemovement.cpp
+        vel[:, 2] = np.clip(vel[:, 2] - half_grav, -max_vel, max_vel)
+        vel[self.b_on_ground, 2] = 0.0
+
+        # Check to stop player from going faster than 3500 (could happen as a result of air strafing)
+        vel[:, :2] = np.clip(vel[:, :2], -max_vel, max_vel)
+
+    def get_wish_speed(self, idx):
+        key_state = self.key_state
+        # CInput::ComputeForwardMove in client/in_main.cpp
+        forward_wish =  cl_forwardspeed * key_state['+forward'] - cl_backspeed * key_state['+back']
+        # CInput::ComputeSideMove in client/in_main.cpp
+        side_wish = cl_sidespeed * key_state['+moveright'] - cl_sidespeed * key_state['+moveleft']
+        # CInput::ComputeUpwardMove in client/in_main.cpp
+        up_wish = cl_upspeed * key_state['+moveup'] - cl_upspeed * key_state['+movedown']
+
+        # CGameMovement::CategorizePosition shared/gamemovement
+        total = math.sqrt(forward_wish**2 + side_wish**2 + up_wish**2)
+        if total > self.soldier_class.flMaxSpeed:
+            scale = simulation.flMaxSpeed/total
+            forward_wish *= scale
+            side_wish *= scale
+
+        # CGameMovement::HandleDuckingSpeedCrop in shared/gamemovement
+        crop = self.b_crop_speed_ducking[idx]
+        forward_wish = np.where(crop, forward_wish * 0.33333333, forward_wish)
+        side_wish = np.where(crop, side_wish * 0.33333333, side_wish)
+
+        wish_2D_vec = 0.0 + (self.forward_2D[idx] * forward_wish[:, None] + self.right_2D[idx] * side_wish[:, None])
+        wishspeed = length(wish_2D_vec)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            wish_dir = np.where(wishspeed[:, None] != 0.0, wish_2D_vec / wishspeed[:, None], 0.0)
+        return wishspeed, wish_dir
+
+    # CGameMovement::Friction in shared/gamemovement
+    def friction(self, idx):
+        vel = self.vel[idx]
+        speed = length(vel)
+        move = speed >= 0.1
+        idx, vel, speed = idx[move], vel[move], speed[move]
+        newspeed = np.maximum(0.0, speed - sv_friction * self.grip[idx] * tick_duration * np.maximum(speed, sv_stopspeed))
+        self.vel[idx] = vel * newspeed[:, None] / speed[:, None]
+
+    # CTFGameMovement::WalkMove in tf/tf_gamemovement
+    def walkmove(self, idx):
+        flMaxSpeed = self.soldier_class.flMaxSpeed
+        wishspeed, wish_dir = self.get_wish_speed(idx)
+        vel = self.vel[idx]
+        speed = length(vel)
+
+        with np.errstate(divide='ignore'):
+            accel = np.where((0.0 < wishspeed) & (wishspeed < WISHSPEEDTHR),
+                np.maximum(speed, sv_stopspeed) * sv_friction / wishspeed + 1.0, sv_accelerate)
+
+        # CGameMovement::Accelerate in shared/gamemovement.cpp
+        curspeed = vel[:, 0] * wish_dir[:, 0] + vel[:, 1] * wish_dir[:, 1]
+        accelerate = wishspeed > curspeed
+        diff = np.minimum(wishspeed - curspeed, accel * wishspeed * tick_duration * self.grip[idx])
+        vel[accelerate, :2] += diff[accelerate, None] * wish_dir[accelerate]
+
+        # CTFGameMovement::WalkMove in tf/tf_gamemovement
+        newspeed = length(vel)
+        cap = newspeed > flMaxSpeed
+        vel[cap] *= (flMaxSpeed / newspeed[cap])[:, None]
+
+        speed = length(vel)
+        if tf_clamp_back_speed < 1.0:
+            forward_2D = self.forward_2D[idx]
+            flDot = forward_2D[:, 0] * vel[:, 0] + forward_2D[:, 1] * vel[:, 1]
+
+            # Player is going backwards
+            back = (speed > tf_clamp_back_speed_min) & (flDot < 0)
+            # Clamp baclward speed to .9 * walking speed
+            newDot = np.maximum(flDot[back], -flMaxSpeed * tf_clamp_back_speed)
+            vel[back, :2] += forward_2D[back] * (newDot - flDot[back])[:, None]
+
+        # CTFGameMovement::WalkMove in tf/tf_gamemovement
+        speed = length(vel)
+        stop = speed < 1.0
+        vel[stop] = 0.0
+        self.vel[idx] = vel
+
+        idx, vel = idx[~stop], vel[~stop]
+        pos = self.pos[idx]
+        # Homemade float rounding to mimic true tf2 behaviour
+        if simulation.float_mode:
+            vel = round_to_nearest_float(vel)
+        pos += vel * tick_duration
+        if simulation.float_mode:
+            pos = round_to_nearest_float(pos)
+        self.vel[idx] = vel
+        self.pos[idx] = pos
+
+    # CTFGameMovement::AirMove in tf/tf_gamemovement
+    def airmove(self, idx):
+        wishspeed, wish_dir = self.get_wish_speed(idx)
+        vel = self.vel[idx]
+
+        # CGameMovement::AirAccelerate in shared/gamemovement
+        capped_wishspeed = np.minimum(AIRSPEEDCAP, wishspeed)
+        curspeed = vel[:, 0] * wish_dir[:, 0] + vel[:, 1] * wish_dir[:, 1]
+        accelerate = capped_wishspeed > curspeed
+        diff = np.minimum(capped_wishspeed - curspeed, sv_airaccelerate * wishspeed * tick_duration * self.grip[idx])
+        vel[accelerate, :2] += diff[accelerate, None] * wish_dir[accelerate]
+
+        # Homemade float rounding to mimic true tf2 behaviour
+        if simulation.float_mode:
+            vel = round_to_nearest_float(vel)
+
+        # CGameMovement::TryPlayerMove in shared/gamemovement.cpp
+        pos = self.pos[idx]
+        pos += vel * tick_duration
+        floor_z = self.floor_z[idx]
+        below = pos[:, 2] < floor_z
+        pos[below, 2] = floor_z[below] + COORD_RESOLUTION
+
+        if simulation.float_mode:
+            pos = round_to_nearest_float(pos)
+        self.vel[idx] = vel
+        self.pos[idx] = pos
+
+    """
+        Soldier specific. Mirrors the methods of simulation.Soldier and simulation.Rocket.
+    """
+
+    def simulate_tick(self):
+        self.simulate_player_tick()
+        self.simulate_rockets()
+
+        # CTFWeaponBase::Deploy
+        self.fire_cooldown -= tick_duration
+        # Pretend to switch from shotgun to rocket launcher
+        if self.key_state['shotgun'] > 0.0:
+            self.fire_cooldown = np.maximum(self.soldier_class.deploy_speed, self.fire_cooldown)
+
+        # CTFWeaponBaseGun::PrimaryAttack in tf/tf_weaponbase_gun
+        if self.key_state['+attack'] > 0.0:
+            fire = np.flatnonzero(self.fire_cooldown <= 0)
+            self.fire_cooldown[fire] = self.soldier_class.fire_rate
+            self.shoot_rocket(fire)
+
+    def simulate_rockets(self):
+        owner, explosion_pos = self.move_rockets()
+
+        # Explosions hitting the same soldier are applied one at a time, in order of creation
+        rocket_type = self.launcher.rocket_type
+        while len(owner):
+            _, first = np.unique(owner, return_index=True)
+            self.simulate_knockback(owner[first], explosion_pos[first], rocket_type.explosion_damage, rocket_type.explosion_radius)
+            rest = np.ones(len(owner), dtype=bool)
+            rest[first] = False
+            owner, explosion_pos = owner[rest], explosion_pos[rest]
+
+    # Moves the rockets one tick, without knockback. The exploded rockets are removed.
+    # Returns the owners and the explosion positions of the exploded rockets, in order of creation
+    def move_rockets(self):
+        if not len(self.rocket_owner):
+            return self.rocket_owner, np.zeros((0, 3))
+        pos, vel = self.rocket_pos, self.rocket_vel
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (self.rocket_floor_z - pos[:, 2]) / vel[:, 2]
+        exploded = (0 < t) & (t <= tick_duration)
+
+        # Move to 0.03125 units before wall
+        t = np.maximum(0.0, t[exploded] - COORD_RESOLUTION / length(vel[exploded]))
+        explosion_pos = pos[exploded] + vel[exploded] * t[:, None]
+        # CTFBaseRocket::Explode
+        # Go 1 extra unit out from plane
+        explosion_pos[:, 2] += 1.0
+        owner = self.rocket_owner[exploded]
+
+        alive = ~exploded
+        pos = pos[alive] + vel[alive] * tick_duration
+        if simulation.float_mode:
+            pos = round_to_nearest_float(pos)
+        self.rocket_owner = self.rocket_owner[alive]
+        self.rocket_pos = pos
+        self.rocket_vel = vel[alive]
+        self.rocket_floor_z = self.rocket_floor_z[alive]
+        return owner, explosion_pos
+
+    def shoot_rocket(self, idx):
+        if not len(idx):
+            return
+        launcher = self.launcher
+        theta = self.angle[idx]/360 * (2 * math.pi)
+
+        # Note: math.sin/cos are used since numpy's versions are not always identical
+        unique_theta, inverse = np.unique(theta, return_inverse=True)
+        sin_theta = np.array([math.sin(x) for x in unique_theta])[inverse]
+        cos_theta = np.array([math.cos(x) for x in unique_theta])[inverse]
+
+        # Compute where the player is currently looking
+        # This is where the rocket should be aimed at
+        forward_2D = self.forward_2D[idx]
+        view_dir = np.empty((len(idx), 3))
+        view_dir[:, 2] = sin_theta
+        view_dir[:, :2] = forward_2D * cos_theta[:, None]
+
+        view_pos = self.pos[idx]
+        view_pos[:, 2] += self.z_eye_offset[idx]
+
+        floor_z = self.floor_z[idx]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dist = np.where(theta != 0.0, (floor_z - view_pos[:, 2]) / sin_theta, 2000.0)
+        dist[(dist < 200.0) | (dist > 2000.0)] = 2000.0
+
+        aim_at = view_pos + view_dir * dist[:, None]
+
+        # Compute launcher position using maths
+        forward = view_dir
+        right = np.zeros((len(idx), 3))
+        right[:, :2] = self.right_2D[idx]
+        up = np.empty((len(idx), 3))
+        up[:, 2] = cos_theta
+        up[:, :2] = -forward_2D * sin_theta[:, None]
+
+        up_offset = np.where(self.b_ducked[idx], launcher.offset_up_ducked, launcher.offset_up_standing)
+        launcher_pos = view_pos + (forward * launcher.offset_forward + right * launcher.offset_right + up * up_offset[:, None])
+
+        rocket_vel = aim_at - launcher_pos
+        scale = launcher.rocket_type.rocket_speed / length(rocket_vel)
+        rocket_vel = rocket_vel * scale[:, None]
+
+        self.rocket_owner = np.concatenate((self.rocket_owner, idx))
+        self.rocket_pos = np.concatenate((self.rocket_pos, launcher_pos))
+        self.rocket_vel = np.concatenate((self.rocket_vel, rocket_vel))
+        self.rocket_floor_z = np.concatenate((self.rocket_floor_z, floor_z))
+
+    # Note: Every soldier in idx is hit by exactly one explosion
+    def simulate_knockback(self, idx, explosion_pos, explosion_damage, explosion_radius):
+        delta_vel, hit = knockback_kernel(explosion_pos, explosion_damage, explosion_radius,
+                self.pos[idx], self.b_ducked[idx], self.b_on_ground[idx], self.soldier_class)
+        self.vel[idx[hit]] += delta_vel[hit]
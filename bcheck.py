@@ -0,0 +1,164 @@
+"""
+    Bounce checker.
+
+    Checks which ways of landing on a floor result in a bounce, for many
+    floor heights at once. The player starts at the start height (with vertical
+    speed --vel) and falls down onto each of the floors.
+
+    Landing types
+        standing  Falls unducked, lands 1.0 to 2.0 units above the floor (standing bounce)
+        crouched  Falls ducked, lands 1.0 to 2.0 units above the floor (crouched bounce)
+        jumpbug   Falls ducked, unducks and jumps when 20.0 to 22.0 units above the floor
+        ctap      Falls ducked, unducks (moving 20 units down) the tick before landing,
+                  then lands 1.0 to 2.0 units above the floor (standing bounce)
+        bhop      Falls unducked, jumps on the first tick on the ground
+                  while 1.0 to 2.0 units above the floor
+
+    Note: The start height is the z of the player origin. The ducked landing types
+          start out ducked, i.e. the player ducked before reaching the start height.
+
+    All floors are simulated together using batch_simulation.Batch_soldier,
+    with +duck and +jump pressed per soldier. With --table, the landing types found
+    in a landing table (see landing_table.py) are looked up instead of simulated.
+    The table has to be built for the same start height and vertical speed,
+    floors that are not on the grid of the table are simulated.
+
+    Usage
+        python bcheck.py 1088 0 -64.5 -128
+        python bcheck.py 1088 --file heights.txt --vel 283 --bounces-only
+        python bcheck.py 0 --file heights.txt --table table.bin
+"""
+
+import argparse
+import numpy as np
+
+import simulation
+from batch_simulation import Batch_soldier
+from landing_table import Landing_table
+from simulation import tick_duration, sv_gravity
+
+landing_types = ('standing', 'crouched', 'jumpbug', 'ctap', 'bhop')
+
+# Checks all landing types for all floors.
+# Returns a dict landing type -> bool array, True if that landing type bounces on floor_z[i]
+def check_landings(start_z, floor_z, vel = 0.0, types = landing_types, max_ticks = 10000):
+    floor_z = np.asarray(floor_z, dtype=float)
+    return {landing_type : check_landing(landing_type, start_z, floor_z, vel, max_ticks) for landing_type in types}
+
+def check_landing(landing_type, start_z, floor_z, vel = 0.0, max_ticks = 10000):
+    n = len(floor_z)
+    b_ducked = landing_type in ('crouched', 'jumpbug', 'ctap')
+    key_state = simulation.Key_state()
+    batch = Batch_soldier(key_state, np.tile([0.0, 0.0, start_z], (n, 1)), vel=[0.0, 0.0, vel], floor_z=floor_z,
+                          b_ducked=b_ducked, b_prev_tick_duck_pressed=b_ducked)
+    half_grav = sv_gravity * 0.5 * tick_duration
+
+    bounce = np.zeros(n, dtype=bool)
+    # Soldiers that have gotten their input (jumped or unducked)
+    triggered = np.zeros(n, dtype=bool)
+    done = np.zeros(n, dtype=bool)
+    for _ in range(max_ticks):
+        if done.all():
+            break
+        z = batch.pos[:, 2] - batch.floor_z
+        vz = batch.vel[:, 2]
+        in_air = ~batch.b_on_ground
+
+        if landing_type == 'jumpbug':
+            # Unducking moves the player 20 units down, the player only lands if it is then below 2.0
+            trigger = ~triggered & in_air & batch.b_ducked & (vz <= 0.0) & (0.0 < z - 20.0) & (z - 20.0 < 2.0)
+        elif landing_type == 'ctap':
+            # Unducking moves the player 20 units down. Unduck so that the player
+            # is still in the air after this tick, but reaches the floor during the next tick
+            z_next = z + (vz - half_grav) * tick_duration - 20.0
+            z_next_next = z_next + (vz - 3.0 * half_grav) * tick_duration
+            trigger = ~triggered & in_air & batch.b_ducked & (z >= 20.0) & (z_next >= 2.0) & (z_next_next < 2.0)
+        elif landing_type == 'bhop':
+            trigger = ~triggered & batch.b_on_ground
+            # CTFGameMovement::PreventBunnyJumping, see player_bhop_detected
+            bounce |= trigger & ~batch.b_ducked & (1.0 < z) & (z <= 2.0)
+        else:
+            trigger = np.zeros(n, dtype=bool)
+        triggered |= trigger
+
+        if b_ducked:
+            key_state.press_key('+duck', (~triggered) * 1.0)
+        if landing_type in ('jumpbug', 'bhop'):
+            key_state.press_key('+jump', triggered * 1.0)
+
+        batch.simulate_tick()
+
+        z = batch.pos[:, 2] - batch.floor_z
+        on_ground = batch.b_on_ground
+        if landing_type == 'jumpbug':
+            # Jumped from being ducked in the air
+            bounce |= trigger & (batch.vel[:, 2] > 0.0)
+            done |= triggered | on_ground
+        elif landing_type == 'bhop':
+            done |= triggered
+        else:
+            # See soldier_standing_bounce_possible and soldier_crouched_bounce_possible
+            window = on_ground & (1.0 < z) & (z <= 2.0) & (batch.vel[:, 2] == 0.0)
+            if landing_type == 'crouched':
+                window &= batch.b_ducked
+            else:
+                window &= ~batch.b_ducked
+            bounce |= window & ~done
+            done |= on_ground
+    return bounce
+
+def read_heights(path):
+    with open(path) as f:
+        return [float(x) for x in f.read().split()]
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Check which landing types bounce on floors at the given heights.')
+    parser.add_argument('start', type=float, help='z of the player at the start')
+    parser.add_argument('floors', type=float, nargs='*', help='z of the floors (default 0.0)')
+    parser.add_argument('--file', help='file with whitespace separated floor heights')
+    parser.add_argument('--vel', type=float, default=0.0, help='vertical speed at the start')
+    parser.add_argument('--types', default=','.join(landing_types), help='comma separated landing types')
+    parser.add_argument('--max-ticks', type=int, default=10000)
+    parser.add_argument('--bounces-only', action='store_true', help='only list floors where something bounces')
+    parser.add_argument('--table', help='landing table to look up standing, crouched, jumpbug and bhop landings in')
+    args = parser.parse_args(argv)
+
+    floors = list(args.floors)
+    if args.file:
+        floors += read_heights(args.file)
+    if not floors:
+        floors = [0.0]
+    types = [t for t in args.types.split(',') if t]
+    for t in types:
+        if t not in landing_types:
+            parser.error('unknown landing type %s, expected one of %s' % (t, ', '.join(landing_types)))
+
+    results = {}
+    if args.table:
+        table = Landing_table(args.table)
+        if args.start != table.start_z:
+            parser.error('%s starts at %g, not at %g' % (args.table, table.start_z, args.start))
+        if args.vel not in table.vels:
+            parser.error('%s has no vertical speed %g, only %s' % (args.table, args.vel, ', '.join('%g' % v for v in table.vels)))
+        # Floors that are not on the grid of the table are simulated
+        floor_z = np.array(floors, dtype=float)
+        heights = args.start - floor_z
+        exact = table.on_grid(heights) & (table.start_z - heights == floor_z)
+        simulated = np.flatnonzero(~exact)
+        table_types = [t for t in types if t != 'ctap']
+        for t in table_types:
+            results[t] = table.bounces(t, args.vel, heights)
+        if len(simulated):
+            for t, bounce in check_landings(args.start, floor_z[simulated], args.vel, table_types, args.max_ticks).items():
+                results[t][simulated] = bounce
+    results.update(check_landings(args.start, floors, args.vel, [t for t in types if t not in results], args.max_ticks))
+
+    print('floor'.rjust(12), *(t.rjust(9) for t in types))
+    for i, floor in enumerate(floors):
+        bounces = [results[t][i] for t in types]
+        if args.bounces_only and not any(bounces):
+            continue
+        print(('%.5f' % floor).rjust(12), *(('yes' if b else '-').rjust(9) for b in bounces))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+    Benchmarks built from the examples.
+
+    Every example_*.py is run headlessly, i.e. with its prints thrown away and
+    visualizer.visualize replaced by a function that does nothing. For every example it measures
+        ticks               the number of soldier ticks the example simulates
+        seconds             the time of a single run, the best out of repeat samples
+        ticks_per_second    ticks / seconds
+        hook_seconds        the best time when every hook is called (see Full_dispatch)
+        hook_overhead       hook_seconds / seconds - 1
+        peak_memory         the peak memory usage in bytes during one run, measured with tracemalloc
+
+    The results are stored as json, together with a hash of simulation.py. Comparing
+    with an older result file lists the examples that got slower by more than the threshold.
+
+    Usage
+        python benchmark.py --out before.json
+        ... change simulation.py ...
+        python benchmark.py --out after.json --compare before.json
+"""
+
+import argparse
+import contextlib
+import glob
+import hashlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import simulation
+import visualizer
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+def example_paths(pattern = 'example_*.py'):
+    # Sorted by example number
+    def number(path):
+        return int(os.path.basename(path).split('_')[1])
+    return sorted(glob.glob(os.path.join(here, pattern)), key = number)
+
+def example_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+# The examples are compiled once, so that only the simulation is timed
+def load_example(path):
+    with open(path) as f:
+        return compile(f.read(), path, 'exec')
+
+# Runs an example without printing anything or opening any windows
+def run_example(code):
+    visualize = visualizer.visualize
+    visualizer.visualize = lambda *args, **kwargs: None
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            exec(code, {'__name__' : '__main__', '__file__' : code.co_filename})
+    finally:
+        visualizer.visualize = visualize
+
+# A hook dispatch where every hook that is not overridden does nothing,
+# instead of being skipped. Used to measure the cost of the hook calls.
+class Full_dispatch(simulation.Hook_dispatch):
+    __slots__ = ()
+
+    def __init__(self, hook = None):
+        super().__init__(hook)
+        base = simulation.Hook_Base()
+        for name in simulation.hook_names:
+            if getattr(self, name) is None:
+                setattr(self, name, getattr(base, name))
+
+@contextlib.contextmanager
+def full_dispatch():
+    dispatch = simulation.Hook_dispatch
+    simulation.Hook_dispatch = Full_dispatch
+    try:
+        yield
+    finally:
+        simulation.Hook_dispatch = dispatch
+
+def count_ticks(code):
+    simulate_tick = simulation.Player.simulate_tick
+    ticks = 0
+    def counted_simulate_tick(player):
+        nonlocal ticks
+        ticks += 1
+        simulate_tick(player)
+    simulation.Player.simulate_tick = counted_simulate_tick
+    try:
+        run_example(code)
+    finally:
+        simulation.Player.simulate_tick = simulate_tick
+    return ticks
+
+# The best time of a single run of the example out of repeat samples.
+# Every sample runs the example number times, which is chosen such that a sample takes at least min_time seconds.
+def best_time(code, repeat, min_time = 0.2):
+    def sample(number):
+        start = time.perf_counter()
+        for _ in range(number):
+            run_example(code)
+        return time.perf_counter() - start
+
+    number = 1
+    while sample(number) < min_time:
+        number *= 2
+    return min(sample(number) for _ in range(repeat)) / number
+
+def peak_memory(code):
+    tracemalloc.start()
+    try:
+        run_example(code)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def benchmark_example(path, repeat = 5, min_time = 0.2):
+    code = load_example(path)
+    # Counting the ticks also warms up the imports
+    ticks = count_ticks(code)
+    seconds = best_time(code, repeat, min_time)
+    with full_dispatch():
+        hook_seconds = best_time(code, repeat, min_time)
+    return {
+        'ticks' : ticks,
+        'seconds' : seconds,
+        'ticks_per_second' : ticks / seconds,
+        'hook_seconds' : hook_seconds,
+        'hook_overhead' : hook_seconds / seconds - 1.0,
+        'peak_memory' : peak_memory(code),
+    }
+
+def simulation_hash():
+    with open(simulation.__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def run_benchmarks(paths = None, repeat = 5, min_time = 0.2):
+    if paths is None:
+        paths = example_paths()
+    return {
+        'version' : 1,
+        'simulation_sha256' : simulation_hash(),
+        'python' : sys.version.split()[0],
+        'platform' : platform.platform(),
+        'repeat' : repeat,
+        'min_time' : min_time,
+        'examples' : {example_name(path) : benchmark_example(path, repeat, min_time) for path in paths},
+    }
+
+# Returns a list of (example, old ticks_per_second, new ticks_per_second, change)
+# for the examples that got more than threshold slower
+def regressions(old, new, threshold = 0.1):
+    slower = []
+    for name, result in new['examples'].items():
+        if name not in old['examples']:
+            continue
+        before = old['examples'][name]['ticks_per_second']
+        after = result['ticks_per_second']
+        change = after / before - 1.0
+        if change < -threshold:
+            slower.append((name, before, after, change))
+    return slower
+
+def format_results(results, old = None):
+    lines = ['%-52s %8s %12s %10s %10s' % ('example', 'ticks', 'ticks/s', 'hooks', 'peak KiB') + ('  change' if old else '')]
+    for name, r in results['examples'].items():
+        line = '%-52s %8d %12.0f %+9.1f%% %10.1f' % (name, r['ticks'], r['ticks_per_second'], 100 * r['hook_overhead'], r['peak_memory'] / 1024)
+        if old and name in old['examples']:
+            line += ' %+6.1f%%' % (100 * (r['ticks_per_second'] / old['examples'][name]['ticks_per_second'] - 1.0))
+        lines.append(line)
+    return '\n'.join(lines)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark the simulation using the examples.')
+    parser.add_argument('examples', nargs='*', help='example files (default all example_*.py)')
+    parser.add_argument('--repeat', type=int, default=5, help='samples per example, the best time is used')
+    parser.add_argument('--min-time', type=float, default=0.2, help='minimum length of a sample in seconds')
+    parser.add_argument('--out', help='json file to store the results in')
+    parser.add_argument('--compare', help='json file with older results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown that counts as a regression (default 0.1 = 10%%)')
+    args = parser.parse_args(argv)
+
+    old = None
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+
+    results = run_benchmarks(args.examples or None, args.repeat, args.min_time)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent = 1)
+    print(format_results(results, old))
+
+    if old:
+        slower = regressions(old, results, args.threshold)
+        for name, before, after, change in slower:
+            print('REGRESSION %s: %.0f -> %.0f ticks/s (%+.1f%%)' % (name, before, after, 100 * change))
+        if slower:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,217 @@
+"""
+    Golden trajectories.
+
+    A corpus of recorded trajectories used to check that changes to the simulation
+    (e.g. performance rewrites) give exactly the same results as before, bit for bit.
+
+    Every case is stored as golden/<name>.npz containing
+        case      json describing how to rerun the case
+        fields    the names of the columns of states
+        states    float64 array with one row per simulated tick, the state of the soldier after that tick
+
+    There are two kinds of cases
+        example   one of the example_*.py files, run headlessly (see benchmark.py)
+        script    a soldier and a list of inputs (tick, key, value), run with input_script.Timeline.
+                  These are generated randomly from a seed, but the inputs themselves are stored,
+                  so the cases do not change if the generator changes.
+
+    Checking reruns every case and compares the states with the golden ones as raw bits
+    (so -0.0 != 0.0). The first tick and field that differ are reported.
+
+    Usage
+        python golden.py record                 record all examples and 20 random scripts
+        python golden.py check                  rerun and compare every case in golden/
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+from contextlib import contextmanager
+
+import numpy as np
+
+import simulation
+from input_script import Timeline
+
+here = os.path.dirname(os.path.abspath(__file__))
+golden_directory = os.path.join(here, 'golden')
+
+fields = [
+    'x', 'y', 'z', 'vx', 'vy', 'vz',
+    'b_on_ground', 'b_ducked', 'b_ducking',
+    'duck_animation', 'reduck_timer', 'airduck_counter',
+    'z_eye_offset', 'grip', 'fire_cooldown', 'rockets',
+]
+
+def soldier_state(soldier):
+    return (*soldier.pos, *soldier.vel,
+            soldier.b_on_ground, soldier.b_ducked, soldier.b_ducking,
+            soldier.duck_animation, soldier.reduck_timer, soldier.airduck_counter,
+            soldier.z_eye_offset, soldier.grip, soldier.fire_cooldown, len(soldier.rocket_scheduler))
+
+# Records the state of every soldier after every tick into the yielded list
+@contextmanager
+def recording():
+    rows = []
+    simulate_tick = simulation.Soldier.simulate_tick
+    def recorded_simulate_tick(soldier):
+        simulate_tick(soldier)
+        rows.append(soldier_state(soldier))
+    simulation.Soldier.simulate_tick = recorded_simulate_tick
+    try:
+        yield rows
+    finally:
+        simulation.Soldier.simulate_tick = simulate_tick
+
+def states_array(rows):
+    return np.array(rows, dtype=np.float64).reshape(-1, len(fields))
+
+"""
+    Running cases
+"""
+
+launchers = {cls.__name__ : cls for cls in (simulation.Original, simulation.Stock, simulation.Mangler)}
+
+def make_soldier(spec):
+    return simulation.Soldier(
+        simulation.Key_state(),
+        launcher = launchers[spec['launcher']](),
+        pos = spec['pos'],
+        vel = spec['vel'],
+        angle = spec['angle'],
+        b_on_ground = spec['b_on_ground'],
+        floor = simulation.Floor(spec['floor_z']),
+    )
+
+def run_case(case):
+    if case['type'] == 'example':
+        import benchmark
+        code = benchmark.load_example(os.path.join(here, case['path']))
+        with recording() as rows:
+            benchmark.run_example(code)
+    elif case['type'] == 'script':
+        soldier = make_soldier(case['soldier'])
+        timeline = Timeline([tuple(change) for change in case['inputs']])
+        with recording() as rows:
+            timeline.run(soldier, case['ticks'])
+    else:
+        raise ValueError('unknown case type %s' % case['type'])
+    return states_array(rows)
+
+# Keys that are pressed and released at random. Movement keys are held longer than the rest.
+random_keys = {
+    '+forward' : 60, '+back' : 20, '+moveleft' : 30, '+moveright' : 30,
+    '+jump' : 4, '+duck' : 8, '+attack' : 2, 'shotgun' : 2,
+}
+
+def random_case(seed, ticks = 300):
+    rng = random.Random(seed)
+    on_ground = rng.random() < 0.5
+    soldier = {
+        'launcher' : rng.choice(sorted(launchers)),
+        'pos' : [0.0, 0.0, 0.0 if on_ground else rng.uniform(0.0, 400.0)],
+        'vel' : [rng.uniform(-300.0, 300.0), rng.uniform(-300.0, 300.0), 0.0 if on_ground else rng.uniform(-800.0, 800.0)],
+        'angle' : rng.uniform(-89.0, 89.0),
+        'b_on_ground' : on_ground,
+        'floor_z' : 0.0,
+    }
+    inputs = []
+    tick = -1
+    while tick < ticks:
+        if rng.random() < 0.2:
+            inputs.append((tick, 'angle', rng.uniform(-89.0, 89.0)))
+        else:
+            key = rng.choice(sorted(random_keys))
+            held = rng.randint(1, 2 * random_keys[key])
+            inputs.append((tick, key, 1.0))
+            inputs.append((tick + held, key, 0.0))
+        tick += rng.randint(0, 12)
+    inputs.sort(key = lambda change: change[0])
+    return {'type' : 'script', 'seed' : seed, 'soldier' : soldier, 'inputs' : inputs, 'ticks' : ticks}
+
+def example_cases():
+    import benchmark
+    return {benchmark.example_name(path) : {'type' : 'example', 'path' : os.path.basename(path)} for path in benchmark.example_paths()}
+
+def script_cases(count, seed = 0, ticks = 300):
+    return {'script_%03d' % i : random_case(seed + i, ticks) for i in range(count)}
+
+"""
+    Recording and checking
+"""
+
+def save_case(path, case, states):
+    np.savez_compressed(path, case = json.dumps(case), fields = np.array(fields), states = states)
+
+def load_case(path):
+    with np.load(path) as data:
+        return json.loads(str(data['case'])), [str(field) for field in data['fields']], data['states']
+
+def record(directory = golden_directory, cases = None):
+    if cases is None:
+        cases = {**example_cases(), **script_cases(20)}
+    os.makedirs(directory, exist_ok=True)
+    for name, case in cases.items():
+        save_case(os.path.join(directory, name + '.npz'), case, run_case(case))
+    return list(cases)
+
+# Returns None if states are bit identical to golden, otherwise (tick, field, golden value, value).
+# tick is the first tick with a difference, and field is the first field that differs on that tick.
+# If one of them is shorter, tick is the length of the shorter one and field is None.
+def compare(golden, states, golden_fields = fields):
+    n = min(len(golden), len(states))
+    a = np.ascontiguousarray(golden[:n], dtype=np.float64).view(np.uint64)
+    b = np.ascontiguousarray(states[:n], dtype=np.float64).view(np.uint64)
+    different = a != b
+    rows = np.flatnonzero(different.any(axis=1))
+    if len(rows):
+        tick = int(rows[0])
+        column = int(np.argmax(different[tick]))
+        return tick, golden_fields[column], float(golden[tick, column]), float(states[tick, column])
+    if len(golden) != len(states):
+        return n, None, len(golden), len(states)
+    return None
+
+# Reruns the case stored in path. Returns None if it matches, otherwise see compare
+def check_case(path):
+    case, golden_fields, golden = load_case(path)
+    if golden_fields != fields:
+        raise ValueError('%s was recorded with fields %s' % (path, golden_fields))
+    return compare(golden, run_case(case), golden_fields)
+
+def check(directory = golden_directory):
+    failures = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.npz'))):
+        difference = check_case(path)
+        if difference is not None:
+            failures[os.path.splitext(os.path.basename(path))[0]] = difference
+    return failures
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Record or check the golden trajectories.')
+    parser.add_argument('command', choices=['record', 'check'])
+    parser.add_argument('--directory', default=golden_directory)
+    parser.add_argument('--scripts', type=int, default=20, help='number of random scripts to record')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first random script')
+    parser.add_argument('--ticks', type=int, default=300, help='ticks per random script')
+    args = parser.parse_args(argv)
+
+    if args.command == 'record':
+        names = record(args.directory, {**example_cases(), **script_cases(args.scripts, args.seed, args.ticks)})
+        print('recorded %d cases in %s' % (len(names), args.directory))
+        return 0
+
+    failures = check(args.directory)
+    for name, (tick, field, expected, value) in failures.items():
+        if field is None:
+            print('%s: %d golden ticks but %d ticks simulated' % (name, expected, value))
+        else:
+            print('%s: tick %d, %s is %r but should be %r' % (name, tick, field, value, expected))
+    print('%d cases differ' % len(failures) if failures else 'all cases match')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+    Input scripts.
+
+    An input script is a list of events, such as pressing or releasing keys
+    and changing the angle, at specific ticks. Same as in the examples, the
+    changes of a tick are applied after simulating that tick
+    (tick -1 means before the first tick).
+
+    Every event can be repeated count times, every `every` ticks.
+    For example, the 30 ctaps of example 13 are
+
+        script = Input_script()
+        script.press(-1, '+forward')
+        script.press(109, '+jump', '+duck', every=43, count=30)
+        script.release(110, '+jump', '+duck', every=43, count=30)
+        script.hold(112, 3, '+duck', every=43, count=30)
+
+    Before running, a script is compiled into a Timeline, which holds the key
+    changes of every tick. Applying the inputs of a tick is then a single list lookup.
+
+        timeline = script.compile()
+        for tick in range(1600):
+            p.simulate_tick()
+            timeline.apply(p, tick)
+
+    Scripts can be saved to/loaded from json files, e.g. to share them between sweeps.
+"""
+
+import json
+
+from simulation import available_keys
+
+def apply_input(soldier, key, value):
+    if key == 'angle':
+        soldier.angle = value
+    elif value:
+        soldier.key_state.press_key(key, value)
+    else:
+        soldier.key_state.release_key(key)
+
+class Input_script:
+    def __init__(self, events = ()):
+        # Every event is a dict with type ('press', 'release', 'hold' or 'angle'), tick, every and count
+        # plus keys and value (press), keys (release), keys and ticks (hold), angle (angle)
+        self.events = [dict(event) for event in events]
+
+    def add(self, event_type, tick, every = None, count = 1, **kwargs):
+        if count > 1 and not every:
+            raise ValueError('repeated events need every > 0')
+        self.events.append(dict(type = event_type, tick = tick, every = every, count = count, **kwargs))
+        return self
+
+    def press(self, tick, *keys, value = 1.0, every = None, count = 1):
+        return self.add('press', tick, every, count, keys = list(keys), value = value)
+
+    def release(self, tick, *keys, every = None, count = 1):
+        return self.add('release', tick, every, count, keys = list(keys))
+
+    # Press keys after tick, and release them ticks later
+    def hold(self, tick, ticks, *keys, value = 1.0, every = None, count = 1):
+        return self.add('hold', tick, every, count, keys = list(keys), ticks = ticks, value = value)
+
+    def angle(self, tick, angle, every = None, count = 1):
+        return self.add('angle', tick, every, count, angle = angle)
+
+    # The script as a list of (tick, key, value), in the order they are applied
+    def to_inputs(self):
+        inputs = []
+        for order, event in enumerate(self.events):
+            for i in range(event['count']):
+                tick = event['tick'] + i * (event['every'] or 0)
+                if event['type'] == 'press':
+                    changes = [(tick, key, event['value']) for key in event['keys']]
+                elif event['type'] == 'release':
+                    changes = [(tick, key, 0.0) for key in event['keys']]
+                elif event['type'] == 'hold':
+                    changes = [(tick, key, event['value']) for key in event['keys']] + \
+                              [(tick + event['ticks'], key, 0.0) for key in event['keys']]
+                elif event['type'] == 'angle':
+                    changes = [(tick, 'angle', event['angle'])]
+                else:
+                    raise ValueError('unknown event type %s' % event['type'])
+                inputs += [(change, order) for change in changes]
+        # Changes of the same tick are applied in the order the events were added
+        inputs.sort(key = lambda x: (x[0][0], x[1]))
+        return [change for change, _ in inputs]
+
+    # The inverse of to_inputs
+    @classmethod
+    def from_inputs(cls, inputs):
+        script = cls()
+        for tick, key, value in inputs:
+            if key == 'angle':
+                script.angle(tick, value)
+            elif value:
+                script.press(tick, key, value = value)
+            else:
+                script.release(tick, key)
+        return script
+
+    def compile(self):
+        return Timeline(self.to_inputs())
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'version' : 1, 'events' : self.events}, f, indent = 1)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f)['events'])
+
+class Timeline:
+    def __init__(self, inputs):
+        for _, key, _ in inputs:
+            if key != 'angle' and key not in available_keys:
+                raise ValueError('unknown key %s' % key)
+        last_tick = max((tick for tick, _, _ in inputs), default = -1)
+        # changes[tick + 1] is the list of (key, value) to apply after tick
+        self.changes = [[] for _ in range(last_tick + 2)]
+        for tick, key, value in inputs:
+            if tick < -1:
+                raise ValueError('inputs can not be before tick -1')
+            self.changes[tick + 1].append((key, value))
+
+    def apply(self, soldier, tick):
+        if tick + 1 < len(self.changes):
+            for key, value in self.changes[tick + 1]:
+                apply_input(soldier, key, value)
+
+    # Simulates ticks ticks of soldier, applying the inputs as in the examples
+    def run(self, soldier, ticks):
+        self.apply(soldier, -1)
+        for tick in range(ticks):
+            soldier.simulate_tick()
+            self.apply(soldier, tick)
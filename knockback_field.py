@@ -0,0 +1,195 @@
+"""
+    Knockback fields.
+
+    The velocity an explosion gives the soldier (Soldier.simulate_knockback), precomputed
+    on a 3D grid of explosion positions relative to the feet of the soldier, for each of
+    the four ground/duck states. Computed with batch_simulation.knockback_kernel.
+
+    The field is stored as a compressed .npz file containing
+        x, y, z      the grid axes (explosion position minus the position of the feet)
+        delta_vel    float64 array of shape (4, len(x), len(y), len(z), 3)
+        hit          bool array of shape (4, len(x), len(y), len(z))
+        damage, radius, version
+
+    Queries either interpolate the grid trilinearly, or look up grid points exactly.
+    Exact lookups give the same result as simulate_knockback for a soldier with its feet
+    at the origin (for other positions the float rounding may differ slightly).
+
+    Usage
+        python knockback_field.py build field.npz --extent 160 --step 4
+        python knockback_field.py heatmap field.npz ground_ducked.png --state ground_ducked --plane xz
+
+        field = Knockback_field.load('field.npz')
+        delta_vel = field.lookup([[10.0, 0.0, -5.0]], b_on_ground = True, b_ducked = True)
+"""
+
+import argparse
+
+import numpy as np
+
+import simulation
+from batch_simulation import knockback_kernel
+
+# (b_on_ground, b_ducked) of every state, in the order they are stored
+states = {
+    'air_standing' : (False, False),
+    'air_ducked' : (False, True),
+    'ground_standing' : (True, False),
+    'ground_ducked' : (True, True),
+}
+
+def state_index(b_on_ground, b_ducked):
+    return list(states.values()).index((bool(b_on_ground), bool(b_ducked)))
+
+class Knockback_field:
+    def __init__(self, x, y, z, delta_vel, hit, damage, radius):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.z = np.asarray(z, dtype=float)
+        self.delta_vel = delta_vel
+        self.hit = hit
+        self.damage = damage
+        self.radius = radius
+
+    @classmethod
+    def compute(cls, x, y, z, damage = None, radius = None, soldier_class = simulation.Soldier):
+        rocket_type = simulation.Standard_rocket
+        damage = rocket_type.explosion_damage if damage is None else damage
+        radius = rocket_type.explosion_radius if radius is None else radius
+        x, y, z = (np.asarray(axis, dtype=float) for axis in (x, y, z))
+
+        explosion_pos = np.stack(np.meshgrid(x, y, z, indexing='ij'), axis=-1)
+        delta_vel = np.zeros((len(states),) + explosion_pos.shape)
+        hit = np.zeros((len(states),) + explosion_pos.shape[:-1], dtype=bool)
+        feet = np.zeros(3)
+        for i, (b_on_ground, b_ducked) in enumerate(states.values()):
+            delta_vel[i], hit[i] = knockback_kernel(explosion_pos, damage, radius, feet, b_ducked, b_on_ground, soldier_class)
+        return cls(x, y, z, delta_vel, hit, damage, radius)
+
+    # A field on the grid -extent <= x, y <= extent, z_min <= z <= z_max with spacing step
+    @classmethod
+    def compute_cube(cls, extent = 160.0, z_min = -40.0, z_max = 160.0, step = 4.0, **kwargs):
+        xy = np.arange(-extent, extent + step / 2, step)
+        return cls.compute(xy, xy, np.arange(z_min, z_max + step / 2, step), **kwargs)
+
+    def save(self, path):
+        np.savez_compressed(path, version = 1, x = self.x, y = self.y, z = self.z,
+                delta_vel = self.delta_vel, hit = self.hit, damage = self.damage, radius = self.radius)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data['version']) != 1:
+                raise ValueError('%s has unknown version %d' % (path, data['version']))
+            return cls(data['x'], data['y'], data['z'], data['delta_vel'], data['hit'],
+                       float(data['damage']), float(data['radius']))
+
+    # For every coordinate, the index of the grid cell it is in and the position within the cell (0 to 1).
+    # Coordinates outside of the grid get index -1.
+    @staticmethod
+    def cell(axis, values):
+        i = np.clip(np.searchsorted(axis, values, side='right') - 1, 0, len(axis) - 2)
+        t = (values - axis[i]) / (axis[i + 1] - axis[i])
+        outside = (values < axis[0]) | (values > axis[-1])
+        return np.where(outside, -1, i), t
+
+    # The velocity change for explosions at rel_pos (..., 3) relative to the feet.
+    # Interpolated trilinearly, unless exact is True in which case every position has
+    # to be a grid point. Positions outside of the grid give nan.
+    def lookup(self, rel_pos, b_on_ground, b_ducked, exact = False):
+        rel_pos = np.asarray(rel_pos, dtype=float)
+        field = self.delta_vel[state_index(b_on_ground, b_ducked)]
+        if exact:
+            return field[self.grid_index(rel_pos)]
+
+        cells = [self.cell(axis, rel_pos[..., k]) for k, axis in enumerate((self.x, self.y, self.z))]
+        (ix, tx), (iy, ty), (iz, tz) = cells
+        outside = (ix < 0) | (iy < 0) | (iz < 0)
+        ix, iy, iz = (np.maximum(i, 0) for i in (ix, iy, iz))
+
+        result = np.zeros(rel_pos.shape)
+        for dx in (0, 1):
+            wx = tx if dx else 1.0 - tx
+            for dy in (0, 1):
+                wy = ty if dy else 1.0 - ty
+                for dz in (0, 1):
+                    wz = tz if dz else 1.0 - tz
+                    result += (wx * wy * wz)[..., None] * field[ix + dx, iy + dy, iz + dz]
+        result[outside] = np.nan
+        return result
+
+    # True where an explosion at rel_pos (which has to be grid points) hits the soldier
+    def lookup_hit(self, rel_pos, b_on_ground, b_ducked):
+        return self.hit[state_index(b_on_ground, b_ducked)][self.grid_index(np.asarray(rel_pos, dtype=float))]
+
+    def grid_index(self, rel_pos):
+        index = []
+        for k, axis in enumerate((self.x, self.y, self.z)):
+            values = rel_pos[..., k]
+            i = np.clip(np.searchsorted(axis, values), 0, len(axis) - 1)
+            if not (axis[i] == values).all():
+                raise ValueError('exact lookups need positions on the grid')
+            index.append(i)
+        return tuple(index)
+
+    # Saves a heatmap of a slice of the field as an image.
+    # plane 'xy' is the slice at height at, 'xz' the slice at y = at.
+    # component is 'speed' (length of delta_vel), 'vx', 'vy' or 'vz'.
+    def heatmap(self, path, state = 'ground_ducked', plane = 'xz', at = 0.0, component = 'speed', size = (8, 6), dpi = 100):
+        from visualizer import headless_figure
+
+        field = self.delta_vel[list(states).index(state)]
+        if plane == 'xy':
+            field = field[:, :, np.abs(self.z - at).argmin()]
+            axes, labels = (self.x, self.y), ('x', 'y')
+        elif plane == 'xz':
+            field = field[:, np.abs(self.y - at).argmin(), :]
+            axes, labels = (self.x, self.z), ('x', 'z')
+        else:
+            raise ValueError('unknown plane %s' % plane)
+
+        if component == 'speed':
+            values = np.sqrt((field * field).sum(axis=-1))
+        else:
+            values = field[..., ['vx', 'vy', 'vz'].index(component)]
+
+        fig = headless_figure(size, dpi)
+        ax = fig.add_subplot(111)
+        image = ax.imshow(values.T, origin='lower', aspect='equal',
+                extent=(axes[0][0], axes[0][-1], axes[1][0], axes[1][-1]),
+                cmap='viridis' if component == 'speed' else 'coolwarm')
+        fig.colorbar(image, ax=ax, label='%s (units/s)' % component)
+        ax.set_xlabel('explosion %s relative to feet' % labels[0])
+        ax.set_ylabel('explosion %s relative to feet' % labels[1])
+        ax.set_title('%s, %s = %g' % (state, 'z' if plane == 'xy' else 'y', at))
+        fig.savefig(path)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Precompute knockback fields and export heatmaps.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='compute a field and save it')
+    build.add_argument('path')
+    build.add_argument('--extent', type=float, default=160.0, help='grid goes from -extent to extent in x and y')
+    build.add_argument('--z-min', type=float, default=-40.0)
+    build.add_argument('--z-max', type=float, default=160.0)
+    build.add_argument('--step', type=float, default=4.0)
+
+    heatmap = commands.add_parser('heatmap', help='save a heatmap of a slice of a field')
+    heatmap.add_argument('path')
+    heatmap.add_argument('image')
+    heatmap.add_argument('--state', choices=list(states), default='ground_ducked')
+    heatmap.add_argument('--plane', choices=['xy', 'xz'], default='xz')
+    heatmap.add_argument('--at', type=float, default=0.0, help='z of an xy slice or y of an xz slice')
+    heatmap.add_argument('--component', choices=['speed', 'vx', 'vy', 'vz'], default='speed')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        field = Knockback_field.compute_cube(args.extent, args.z_min, args.z_max, args.step)
+        field.save(args.path)
+        print('saved %s with %d x %d x %d points' % (args.path, len(field.x), len(field.y), len(field.z)))
+    else:
+        Knockback_field.load(args.path).heatmap(args.image, args.state, args.plane, args.at, args.component)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+    Landing table.
+
+    Whether a player bounces only depends on where the player ends up relative
+    to the floor when landing. This tabulates, for every (vertical speed at the start,
+    duck state, fall height) the landing tick and the "residue", i.e. how far above the
+    floor the player is on the tick it lands. Bounce checks then become table lookups.
+
+    Every record holds
+        residue          z - floor_z on the tick the player lands
+        tick             the tick the player lands on
+        jumpbug_residue  z - floor_z - 20.0 on the first falling tick with z - floor_z - 20.0 < 2.0
+                         (only for ducked players, NaN otherwise). Unducking moves the player
+                         20 units down, so a jumpbug lands when 0.0 < jumpbug_residue < 2.0
+
+    The player starts at start_z and the floor is at start_z - fall height.
+    Heights go from h_min in steps of h_step. Lookups are exact when the start height is
+    start_z and the fall height is on the grid, otherwise the closest grid point is used
+    (see on_grid).
+
+    File format (little endian)
+        header   magic, version, number of speeds, number of heights, start_z, h_min, h_step
+        speeds   float64 for every speed bucket
+        records  (speeds, duck state, heights) records of float64, int32, float64
+
+    The records are loaded with np.memmap, so opening a table does not read it into memory.
+
+    Usage
+        python landing_table.py table.bin --start 0 --vels 0,283 --max-height 2000 --step 0.125
+"""
+
+import argparse
+import struct
+import numpy as np
+
+import simulation
+from batch_simulation import Batch_soldier
+
+magic = b'TF2LAND\0'
+version = 3
+header_struct = struct.Struct('<8sIIIddd')
+
+# The residues are compared against the bounce bounds, so they are stored without rounding
+record_dtype = np.dtype([('residue', '<f8'), ('tick', '<i4'), ('jumpbug_residue', '<f8')])
+
+# Simulates falls from start_z for all heights at once
+# Returns the records for a single speed and duck state
+def simulate_landings(start_z, vel, b_ducked, heights, max_ticks = 10000):
+    n = len(heights)
+    key_state = simulation.Key_state()
+    if b_ducked:
+        key_state.press_key('+duck')
+    batch = Batch_soldier(key_state, np.tile([0.0, 0.0, start_z], (n, 1)), vel=[0.0, 0.0, vel],
+                          floor_z=start_z - heights, b_ducked=b_ducked, b_prev_tick_duck_pressed=b_ducked)
+
+    records = np.zeros(n, dtype=record_dtype)
+    records['tick'] = -1
+    records['jumpbug_residue'] = np.nan
+    jumpbug_done = np.zeros(n, dtype=bool) | (not b_ducked)
+    landed = np.zeros(n, dtype=bool)
+    for tick in range(max_ticks):
+        if landed.all():
+            break
+        # See player_jumpbug_possible. After unducking the player is at z, and only lands if z < 2.0
+        z = batch.pos[:, 2] - batch.floor_z - 20.0
+        window = ~jumpbug_done & ~batch.b_on_ground & batch.b_ducked & (batch.vel[:, 2] <= 0.0) & (z < 2.0)
+        records['jumpbug_residue'][window] = z[window]
+        jumpbug_done |= window
+
+        batch.simulate_tick()
+
+        land = ~landed & batch.b_on_ground
+        records['residue'][land] = (batch.pos[:, 2] - batch.floor_z)[land]
+        records['tick'][land] = tick
+        landed |= land
+    return records
+
+def build_table(path, start_z, vels, h_min, h_max, h_step, max_ticks = 10000):
+    n_heights = int(round((h_max - h_min) / h_step)) + 1
+    heights = h_min + h_step * np.arange(n_heights)
+    vels = np.asarray(vels, dtype=float)
+
+    with open(path, 'wb') as f:
+        f.write(header_struct.pack(magic, version, len(vels), n_heights, start_z, h_min, h_step))
+        f.write(vels.astype('<f8').tobytes())
+        for vel in vels:
+            for b_ducked in (False, True):
+                f.write(simulate_landings(start_z, vel, b_ducked, heights, max_ticks).tobytes())
+
+class Landing_table:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(header_struct.size)
+            file_magic, file_version, n_vels, n_heights, self.start_z, self.h_min, self.h_step = header_struct.unpack(header)
+            if file_magic != magic or file_version != version:
+                raise ValueError('%s is not a version %d landing table' % (path, version))
+            self.vels = np.frombuffer(f.read(8 * n_vels), dtype='<f8')
+        offset = header_struct.size + 8 * n_vels
+        self.records = np.memmap(path, dtype=record_dtype, mode='r', offset=offset, shape=(n_vels, 2, n_heights))
+
+    # True for heights that are grid points of the table
+    def on_grid(self, heights):
+        heights = np.asarray(heights, dtype=float)
+        j = np.rint((heights - self.h_min) / self.h_step)
+        return (0 <= j) & (j < self.records.shape[2]) & (self.h_min + self.h_step * j == heights)
+
+    # The records of falling height units with vertical speed vel (closest bucket)
+    # Heights outside of the table get tick -1 and NaN residues
+    def lookup(self, vel, b_ducked, heights):
+        heights = np.asarray(heights, dtype=float)
+        i = np.argmin(np.abs(self.vels - vel))
+        j = np.rint((heights - self.h_min) / self.h_step).astype(int)
+        inside = (0 <= j) & (j < self.records.shape[2])
+        records = np.zeros(len(heights), dtype=record_dtype)
+        records['tick'] = -1
+        records['residue'] = records['jumpbug_residue'] = np.nan
+        records[inside] = self.records[i, int(b_ducked), j[inside]]
+        return records
+
+    # Same landing types as bcheck. ctap is not tabulated.
+    def bounces(self, landing_type, vel, heights):
+        if landing_type == 'jumpbug':
+            residue = self.lookup(vel, True, heights)['jumpbug_residue']
+            return (0.0 < residue) & (residue < 2.0)
+        if landing_type not in ('standing', 'crouched', 'bhop'):
+            raise ValueError('landing type %s is not in the landing table' % landing_type)
+        residue = self.lookup(vel, landing_type == 'crouched', heights)['residue']
+        return (1.0 < residue) & (residue <= 2.0)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Build a landing table.')
+    parser.add_argument('path')
+    parser.add_argument('--start', type=float, default=0.0, help='z of the player at the start')
+    parser.add_argument('--vels', default='0', help='comma separated vertical speeds at the start')
+    parser.add_argument('--min-height', type=float, default=0.0)
+    parser.add_argument('--max-height', type=float, default=2000.0)
+    parser.add_argument('--step', type=float, default=0.125)
+    args = parser.parse_args(argv)
+
+    vels = [float(x) for x in args.vels.split(',')]
+    build_table(args.path, args.start, vels, args.min_height, args.max_height, args.step)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""
+    Tick profiler.
+
+    Measures how much time every phase of a tick takes. While a Tick_profiler
+    is active, the phase methods of the simulation classes (see phases) are
+    replaced by timed versions. When it is not active the classes are left
+    untouched, so the profiler costs nothing when it is not used.
+
+    For every tick, the time spent in every phase (and the number of calls) is
+    added up and put into a histogram with one bucket per power of 2 nanoseconds.
+    'tick' is the time of the whole tick.
+
+    Usage
+        with profiler.Tick_profiler() as profile:
+            for tick in range(1000):
+                p.simulate_tick()
+        print(profile.report())
+
+    Note: Phase times are inclusive. handle_ducking can call categorize_position,
+          and update_rockets (world_update_rockets for a World) calls rocket_tick
+          and simulate_knockback.
+    Note: The methods are replaced on the classes, so every soldier in the process
+          is profiled. Subclasses that override a phase method are not profiled.
+          Ticks skipped by fast_forward_until_event are not counted.
+"""
+
+from functools import wraps
+import time
+
+import simulation
+import world
+
+# Phase name -> (class, method), in the order they happen during a tick
+phases = {
+    'handle_ducking' : (simulation.Player, 'handle_ducking'),
+    'start_gravity' : (simulation.Player, 'start_gravity'),
+    'check_jump_button' : (simulation.Player, 'check_jump_button'),
+    'friction' : (simulation.Player, 'friction'),
+    'walkmove' : (simulation.Player, 'walkmove'),
+    'airmove' : (simulation.Player, 'airmove'),
+    'categorize_position' : (simulation.Player, 'categorize_position'),
+    'finish_gravity' : (simulation.Player, 'finish_gravity'),
+    'update_rockets' : (simulation.Soldier, 'update_rockets'),
+    'world_update_rockets' : (world.World, 'update_rockets'),
+    'rocket_tick' : (simulation.Rocket, 'simulate_tick'),
+    'simulate_knockback' : (simulation.Soldier, 'simulate_knockback'),
+    'shoot_rocket' : (simulation.Soldier, 'shoot_rocket'),
+}
+
+# The classes whose simulate_tick is timed as 'tick'. Only the outermost call is counted,
+# so a tick of a World (with all of its soldiers) is a single tick.
+tick_classes = (simulation.Player, simulation.Soldier, world.World)
+
+class Histogram:
+    def __init__(self):
+        # Bucket b counts the ticks that took 2**(b-1) <= ns < 2**b
+        self.buckets = {}
+        # Number of ticks, number of calls, total and max nanoseconds
+        self.ticks = 0
+        self.calls = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, ns, calls = 1):
+        b = ns.bit_length()
+        self.buckets[b] = self.buckets.get(b, 0) + 1
+        self.ticks += 1
+        self.calls += calls
+        self.total += ns
+        self.max = max(self.max, ns)
+
+    def merge(self, other):
+        for b, count in other.buckets.items():
+            self.buckets[b] = self.buckets.get(b, 0) + count
+        self.ticks += other.ticks
+        self.calls += other.calls
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.total / self.ticks if self.ticks else 0.0
+
+    # Upper bound (in ns) of the q-th quantile, 0 <= q <= 1
+    def quantile(self, q):
+        seen = 0
+        for b in sorted(self.buckets):
+            seen += self.buckets[b]
+            if seen >= q * self.ticks:
+                return min(2**b, self.max)
+        return 0
+
+class Profile:
+    def __init__(self):
+        self.histograms = {name : Histogram() for name in ['tick'] + list(phases)}
+
+    def __getitem__(self, name):
+        return self.histograms[name]
+
+    def merge(self, other):
+        for name, histogram in other.histograms.items():
+            self.histograms.setdefault(name, Histogram()).merge(histogram)
+        return self
+
+    # A table with one row per phase. Times are in microseconds, quantiles are upper bounds.
+    def report(self):
+        tick_total = self['tick'].total or 1
+        lines = ['%-20s %10s %10s %10s %9s %9s %9s %9s %6s' % ('phase', 'ticks', 'calls', 'total ms', 'mean us', 'p50 us', 'p99 us', 'max us', '%tick')]
+        for name, h in self.histograms.items():
+            if not h.ticks:
+                continue
+            lines.append('%-20s %10d %10d %10.1f %9.2f %9.2f %9.2f %9.2f %6.1f' % (
+                name, h.ticks, h.calls, h.total / 1e6, h.mean() / 1e3,
+                h.quantile(0.5) / 1e3, h.quantile(0.99) / 1e3, h.max / 1e3, 100.0 * h.total / tick_total))
+        return '\n'.join(lines)
+
+    # The histogram of a phase as text, one line per bucket
+    def histogram(self, name, width = 50):
+        h = self[name]
+        if not h.ticks:
+            return '%s: no ticks' % name
+        most = max(h.buckets.values())
+        lines = [name]
+        for b in range(min(h.buckets), max(h.buckets) + 1):
+            count = h.buckets.get(b, 0)
+            lines.append('%9.2f us %10d %s' % (2**b / 1e3, count, '#' * round(width * count / most)))
+        return '\n'.join(lines)
+
+class Tick_profiler:
+    def __init__(self, profile = None):
+        self.profile = Profile() if profile is None else profile
+        # Phase name -> [nanoseconds, calls] during the current tick
+        self.current = {name : [0, 0] for name in phases}
+        self.depth = 0
+        self.originals = []
+
+    def timed(self, name, method):
+        current = self.current[name]
+        counter = time.perf_counter_ns
+        @wraps(method)
+        def timed_method(*args, **kwargs):
+            start = counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                current[0] += counter() - start
+                current[1] += 1
+        return timed_method
+
+    def timed_tick(self, method):
+        counter = time.perf_counter_ns
+        @wraps(method)
+        def simulate_tick(simulated):
+            self.depth += 1
+            start = counter()
+            try:
+                return method(simulated)
+            finally:
+                self.depth -= 1
+                if not self.depth:
+                    self.finish_tick(counter() - start)
+        return simulate_tick
+
+    def finish_tick(self, ns):
+        histograms = self.profile.histograms
+        histograms['tick'].add(ns)
+        for name, current in self.current.items():
+            if current[1]:
+                histograms[name].add(current[0], current[1])
+                current[0] = current[1] = 0
+
+    def patch(self, cls, name, method):
+        self.originals.append((cls, name, cls.__dict__[name]))
+        setattr(cls, name, method)
+
+    def start(self):
+        if self.originals:
+            raise RuntimeError('the profiler is already running')
+        for name, (cls, method_name) in phases.items():
+            self.patch(cls, method_name, self.timed(name, cls.__dict__[method_name]))
+        for cls in tick_classes:
+            self.patch(cls, 'simulate_tick', self.timed_tick(cls.__dict__['simulate_tick']))
+
+    def stop(self):
+        for cls, name, method in reversed(self.originals):
+            setattr(cls, name, method)
+        self.originals = []
+
+    def __enter__(self):
+        self.start()
+        return self.profile
+
+    def __exit__(self, *args):
+        self.stop()
+
+"""
+    Profiling sweeps.
+
+    Every worker process profiles its own scenarios, and the profiles
+    are merged together with the results.
+
+    Usage
+        results, profile = profiler.profile_sweep(factory, grid)
+        print(profile.report())
+"""
+
+class Profiled_scenario:
+    def __init__(self, scenario):
+        self.scenario = scenario
+
+    def run(self):
+        with Tick_profiler() as profile:
+            result = self.scenario.run()
+        return result, profile
+
+class Profiled_factory:
+    def __init__(self, factory):
+        self.factory = factory
+
+    def __call__(self, **params):
+        return Profiled_scenario(self.factory(**params))
+
+# Same as sweep.sweep_list, but also returns the merged profile of all scenarios
+def profile_sweep(factory, grid, workers = None, chunk_size = 64):
+    import sweep
+    profile = Profile()
+    results = []
+    for params, (result, scenario_profile) in sweep.sweep_list(Profiled_factory(factory), grid, workers, chunk_size):
+        profile.merge(scenario_profile)
+        results.append((params, result))
+    return results, profile
@@ -0,0 +1,228 @@
+"""
+    Trajectory recorder.
+
+    A hook that records the player, rocket and explosion positions of every tick.
+    Rows are written into preallocated numpy buffers, which are appended to disk
+    every chunk_size rows. This keeps the memory usage constant, also for very long runs.
+
+    The recording is stored as a directory with one raw binary file per column
+        path/meta.json                   the columns (dtype and shape) and number of rows of every table
+        path/player/pos.bin, ...         one row per player per tick
+        path/rocket/pos.bin, ...         one row per rocket per tick
+        path/explosion/pos.bin, ...      one row per explosion
+
+    Every table has a run and a tick column. tick is the tick that was just simulated,
+    same as in the examples (tick -1 is the state when the soldier was created).
+    Start a new run with start_run, e.g. to record many runs of a sweep into the same place.
+
+    Usage
+        recorder = Recorder_hook('recording')
+        p = simulation.Soldier(key_state, hook=recorder)
+        for tick in range(1000):
+            p.simulate_tick()
+        recorder.close()
+
+    Note: Recording rocket positions means that every rocket is updated every tick
+          (see Rocket_scheduler).
+"""
+
+import json
+import os
+import numpy as np
+
+import simulation
+
+tables = {
+    'player' : {
+        'run' : ('<i4', ()),
+        'tick' : ('<i4', ()),
+        'pos' : ('<f8', (3,)),
+        'vel' : ('<f8', (3,)),
+        'b_on_ground' : ('|b1', ()),
+        'b_ducked' : ('|b1', ()),
+    },
+    'rocket' : {
+        'run' : ('<i4', ()),
+        'tick' : ('<i4', ()),
+        'rocket_id' : ('<i8', ()),
+        'pos' : ('<f8', (3,)),
+    },
+    'explosion' : {
+        'run' : ('<i4', ()),
+        'tick' : ('<i4', ()),
+        'rocket_id' : ('<i8', ()),
+        'pos' : ('<f8', (3,)),
+    },
+}
+
+class Table_writer:
+    def __init__(self, path, columns, chunk_size, rows = 0):
+        self.path = path
+        self.columns = columns
+        self.chunk_size = chunk_size
+        # Rows written to disk
+        self.rows = rows
+        # Rows in the buffers
+        self.n = 0
+        self.buffers = {name : np.zeros((chunk_size,) + shape, dtype=dtype) for name, (dtype, shape) in columns.items()}
+        os.makedirs(path, exist_ok=True)
+
+    def append(self, *values):
+        n = self.n
+        for buffer, value in zip(self.buffers.values(), values):
+            buffer[n] = value
+        self.n = n + 1
+        if self.n == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.n:
+            return
+        for name, buffer in self.buffers.items():
+            with open(os.path.join(self.path, name + '.bin'), 'ab') as f:
+                f.write(buffer[:self.n].tobytes())
+        self.rows += self.n
+        self.n = 0
+
+class Recorder_hook(simulation.Hook_Base):
+    # run defaults to 0, or to one more than the last run when appending to a recording
+    def __init__(self, path, run = None, chunk_size = 65536, append = False):
+        self.path = path
+        meta = {}
+        meta_path = os.path.join(path, 'meta.json')
+        if append and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)['tables']
+        elif os.path.exists(meta_path):
+            raise FileExistsError('%s already contains a recording, use append=True to add to it' % path)
+
+        self.writers = {}
+        for table, columns in tables.items():
+            rows = meta[table]['rows'] if table in meta else 0
+            self.writers[table] = Table_writer(os.path.join(path, table), columns, chunk_size, rows)
+        # The runs that are already in the recording
+        self.runs = set()
+        if meta.get('player', {}).get('rows'):
+            self.runs.update(int(run) for run in Recording(path).runs())
+        self.start_run(run)
+
+    # Starts a new run. run defaults to one more than the highest run so far
+    def start_run(self, run = None):
+        if run is None:
+            run = max(self.runs) + 1 if self.runs else 0
+        elif run in self.runs:
+            raise ValueError('run %d is already in the recording %s' % (run, self.path))
+        self.runs.add(run)
+        self.run = run
+        self.tick = -1
+
+    def flush(self):
+        for writer in self.writers.values():
+            writer.flush()
+        meta = {
+            'version' : 1,
+            'tables' : {
+                table : {
+                    'rows' : writer.rows,
+                    'columns' : {name : [dtype, list(shape)] for name, (dtype, shape) in writer.columns.items()},
+                } for table, writer in self.writers.items()
+            },
+        }
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent = 1)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def record_player(self, p):
+        self.writers['player'].append(self.run, self.tick, p.pos, p.vel, p.b_on_ground, p.b_ducked)
+
+    def record_rocket(self, rocket):
+        self.writers['rocket'].append(self.run, self.tick, rocket.rocket_id, rocket.pos)
+
+    # Hooks
+    def player_created(self, p):
+        self.record_player(p)
+    def player_before_tick_update(self, p):
+        self.tick += 1
+    def soldier_after_tick_update(self, p):
+        self.record_player(p)
+
+    def rocket_creation(self, rocket):
+        self.record_rocket(rocket)
+    def rocket_after_tick_update(self, rocket):
+        self.record_rocket(rocket)
+    def rocket_exploded(self, rocket, explosion_pos):
+        self.writers['rocket'].append(self.run, self.tick, rocket.rocket_id, explosion_pos)
+        self.writers['explosion'].append(self.run, self.tick, rocket.rocket_id, explosion_pos)
+
+"""
+    Reading recordings.
+
+    The columns of a recording are opened with np.memmap, so only the rows
+    that are actually used are read from disk. This makes it possible to pick
+    a single run or tick window out of very large recordings.
+
+    Usage
+        recording = Recording('recording')
+        player_pos, rocket_positions, rocket_explosions = recording.trajectory(run = 3, ticks = (100, 400))
+        visualizer.visualize(player_pos, rocket_positions, rocket_explosions)
+"""
+
+class Recording:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)['tables']
+
+    # The columns of a table, as memory mapped arrays
+    def columns(self, table):
+        rows = self.meta[table]['rows']
+        columns = {}
+        for name, (dtype, shape) in self.meta[table]['columns'].items():
+            if rows:
+                columns[name] = np.memmap(os.path.join(self.path, table, name + '.bin'), dtype=dtype, mode='r', shape=(rows,) + tuple(shape))
+            else:
+                columns[name] = np.zeros((0,) + tuple(shape), dtype=dtype)
+        return columns
+
+    def runs(self):
+        return np.unique(self.columns('player')['run'])
+
+    # The rows of table from run with first <= tick < last (ticks = (first, last), None means all ticks)
+    # Returns a dict of column name -> array
+    def select(self, table, run = None, ticks = None):
+        columns = self.columns(table)
+        rows = slice(None)
+        if run is not None:
+            rows = np.flatnonzero(columns['run'] == run)
+            # Runs are usually recorded one after another, then a slice avoids copying
+            if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+                rows = slice(rows[0], rows[-1] + 1)
+        selected = {name : column[rows] for name, column in columns.items()}
+        if ticks is not None:
+            first, last = ticks
+            tick = selected['tick']
+            keep = (first <= tick) & (tick < last)
+            selected = {name : column[keep] for name, column in selected.items()}
+        return selected
+
+    # The trajectory of a run in the same form as in the examples,
+    # i.e. the arguments of visualizer.visualize
+    def trajectory(self, run = 0, ticks = None):
+        player_pos = self.select('player', run, ticks)['pos']
+        rockets = self.select('rocket', run, ticks)
+        # Group the rows by rocket, keeping them in order of tick
+        order = np.argsort(rockets['rocket_id'], kind='stable')
+        rocket_ids, first = np.unique(rockets['rocket_id'][order], return_index=True)
+        positions = np.split(np.asarray(rockets['pos'])[order], first[1:])
+        rocket_positions = {int(rocket_id) : pos for rocket_id, pos in zip(rocket_ids, positions)}
+        explosions = self.select('explosion', run, ticks)
+        rocket_explosions = {int(rocket_id) : pos for rocket_id, pos in zip(explosions['rocket_id'], explosions['pos'])}
+        return player_pos, rocket_positions, rocket_explosions
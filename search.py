@@ -0,0 +1,261 @@
+"""
+    Branch-and-bound search for input sequences.
+
+    Starting from the current state of a soldier, every tick the search tries
+    pressing/releasing each key in keys and switching to each angle in angles.
+    Input sequences that make the soldier bhop, jumpbug or bounce are reported.
+
+    The search space is kept small by
+      - Limiting the total number of input changes (max_changes)
+      - Memoizing visited states in a transposition table (see transposition.py).
+        A state that has already been searched with at least as many ticks
+        and changes left is skipped. Horizontal position is ignored when there are no rockets
+        and +attack can not be pressed (rockets shot later depend on the position)
+      - Pruning states that cannot reach the floor before max_ticks,
+        or that are more than max_height above the floor
+      - Fast forwarding while falling towards the floor, until air_margin ticks
+        before the floor can be reached. Inputs are held during these ticks
+
+    The inputs of a result are a list of (tick, key, value), which are applied
+    after simulating tick, same as in the examples (tick -1 means before the first tick).
+    key is either a key of Key_state or 'angle'. Use replay to run a soldier through them.
+
+    Note: The hook of the soldier is still called during the search, also for
+          branches that get rolled back. The pruning assumes that the hook does
+          not move the floor upwards.
+"""
+
+from collections import namedtuple
+from itertools import combinations
+from math import sqrt
+
+from simulation import tick_duration, sv_gravity
+from input_script import Timeline, apply_input
+from transposition import Transposition_table, state_hash
+
+# The hooks that count as a find
+detected_events = (
+    'player_bhop_detected',
+    'player_jumpbug_detected',
+    'soldier_crouched_bounce_detected',
+    'soldier_standing_bounce_detected',
+    )
+
+# event is the name of the hook, it was called while simulating tick
+Search_result = namedtuple('Search_result', ['event', 'tick', 'inputs'])
+
+class Search_done(Exception):
+    pass
+
+# Lower bound on the number of ticks before the soldier can be close enough to the floor to trigger any event.
+# Ctapping moves the player at most 20 units down, and the events happen up to 2 units above the floor.
+# Note: Rockets hitting the floor only ever push the player upwards
+def ticks_until_floor(soldier):
+    if soldier.b_on_ground:
+        return 0
+    dz = soldier.pos[2] - soldier.floor.z - 22.0
+    if dz <= 0.0:
+        return 0
+    half_grav = sv_gravity * 0.5 * tick_duration
+    b = soldier.vel[2]
+    # After n ticks, the player has fallen about tick_duration * (half_grav * n * n - b * n) units
+    n = (b + sqrt(b * b + 4.0 * half_grav * dz / tick_duration)) / (2.0 * half_grav)
+    return max(0, int(n) - 1)
+
+# Simulates ticks ticks of soldier, applying inputs (list of (tick, key, value)) as in the examples
+def replay(soldier, inputs, ticks):
+    Timeline(inputs).run(soldier, ticks)
+
+class Input_search:
+    def __init__(self, soldier, max_ticks,
+            keys = ('+jump', '+duck'),
+            angles = (),
+            events = detected_events,
+            max_changes = 4,
+            max_height = None,
+            air_margin = 10, # None turns off fast forwarding
+            max_results = None,
+            max_nodes = None,
+            memo_size = 1000000
+        ):
+        self.soldier = soldier
+        self.max_ticks = max_ticks
+        self.keys = keys
+        self.angles = angles
+        self.events = events
+        self.max_changes = max_changes
+        self.max_height = max_height
+        self.air_margin = air_margin
+        self.max_results = max_results
+        self.max_nodes = max_nodes
+
+        self.results = []
+        # Number of simulated ticks (not counting fast forwarded ticks)
+        self.nodes = 0
+        # state_hash -> list of (ticks left, changes left) it has been searched with,
+        # none of which has both more ticks and more changes left than another
+        self.memo = Transposition_table(memo_size)
+        # Set by run
+        self.ignore_xy = False
+        # Events found during the current tick
+        self.found = []
+
+    def run(self):
+        soldier = self.soldier
+        key_state = soldier.key_state
+        root = soldier.snapshot()
+        root_keys = key_state.snapshot()
+        self.ignore_xy = '+attack' not in self.keys and not key_state['+attack'] > 0.0
+
+        # Listen for events by tapping into the hook dispatch of the soldier
+        for event in self.events:
+            setattr(soldier.dispatch, event, self.tap(event, getattr(soldier.dispatch, event)))
+
+        try:
+            self.search(0, self.max_changes, [])
+        except Search_done:
+            pass
+        finally:
+            soldier.hook = soldier.hook # Rebuilds the dispatch
+            soldier.restore(root)
+            key_state.restore(root_keys)
+        return self.results
+
+    def tap(self, event, hook):
+        found = self.found
+        def detected(*args):
+            found.append(event)
+            if hook: hook(*args)
+        return detected
+
+    # The possible input changes for the next tick, fewest changes first
+    def choices(self, changes_left):
+        soldier = self.soldier
+        toggles = [(key, 0.0 if soldier.key_state[key] > 0 else 1.0) for key in self.keys]
+        turns = [None] + [('angle', angle) for angle in self.angles if angle != soldier.angle]
+        choices = []
+        for n in range(len(toggles) + 1):
+            for changes in combinations(toggles, n):
+                for turn in turns:
+                    changes_turn = list(changes) + [turn] if turn else list(changes)
+                    if len(changes_turn) <= changes_left:
+                        choices.append(changes_turn)
+        choices.sort(key = len)
+        return choices
+
+    def search(self, tick, changes_left, inputs):
+        soldier = self.soldier
+        key_state = soldier.key_state
+
+        ticks_left = self.max_ticks - tick
+        if ticks_left <= 0 or ticks_until_floor(soldier) >= ticks_left:
+            return
+        if self.max_height is not None and soldier.pos[2] - soldier.floor.z > self.max_height:
+            return
+
+        key = state_hash(soldier, ignore_xy = self.ignore_xy)
+        searched = self.memo.get(key, [])
+        for ticks, changes in searched:
+            if ticks >= ticks_left and changes >= changes_left:
+                return
+        searched = [(ticks, changes) for ticks, changes in searched if ticks > ticks_left or changes > changes_left]
+        searched.append((ticks_left, changes_left))
+        self.memo[key] = searched
+
+        state = soldier.snapshot()
+        keys = key_state.snapshot()
+        for changes in self.choices(changes_left):
+            self.nodes += 1
+            if self.max_nodes is not None and self.nodes > self.max_nodes:
+                raise Search_done
+
+            for change in changes:
+                apply_input(soldier, *change)
+            next_inputs = inputs + [(tick - 1, key, value) for key, value in changes]
+
+            del self.found[:]
+            soldier.simulate_tick()
+
+            if self.found:
+                for event in self.found:
+                    self.results.append(Search_result(event, tick, next_inputs))
+                if self.max_results is not None and len(self.results) >= self.max_results:
+                    raise Search_done
+            else:
+                skipped = 0
+                if self.air_margin is not None and soldier.vel[2] <= 0.0:
+                    skip = min(ticks_until_floor(soldier), ticks_left - 1) - self.air_margin
+                    if skip > 0:
+                        skipped, _ = soldier.fast_forward_until_event((), skip)
+                self.search(tick + 1 + skipped, changes_left - len(changes), next_inputs)
+
+            soldier.restore(state)
+            key_state.restore(keys)
+
+"""
+    Jumpbug finder.
+
+    A jumpbug is done by unducking right above the floor and jumping on the same tick.
+    find_jumpbugs tries every pair of ticks (unduck_tick, jump_tick) with
+    unduck_tick <= jump_tick within horizon ticks, starting from an airborne soldier
+    that holds +duck (and not +jump).
+
+    Instead of simulating every pair from the start, the trajectories share their prefixes
+      - One trajectory holding +duck, forked at every unduck_tick
+      - From each fork, one trajectory without +duck, forked at every jump_tick
+    so every pair costs a single tick (plus a snapshot/restore). Trajectories stop
+    at the first tick the soldier is on the ground.
+
+    Same as in search, inputs happen after simulating the tick (tick -1 means before the first tick).
+"""
+
+# vel_z is the vertical speed after the tick the jumpbug happened on (jump_tick + 1)
+Jumpbug = namedtuple('Jumpbug', ['unduck_tick', 'jump_tick', 'vel_z'])
+
+def find_jumpbugs(soldier, horizon):
+    key_state = soldier.key_state
+    root = soldier.snapshot()
+    root_keys = key_state.snapshot()
+
+    detected = []
+    jumpbug_hook = soldier.dispatch.player_jumpbug_detected
+    def player_jumpbug_detected(player):
+        detected.append(True)
+        if jumpbug_hook: jumpbug_hook(player)
+    soldier.dispatch.player_jumpbug_detected = player_jumpbug_detected
+
+    results = []
+    try:
+        # The ducked trajectory, the soldier is at tick unduck_tick + 1
+        for unduck_tick in range(-1, horizon - 1):
+            if soldier.b_on_ground:
+                break
+            ducked = soldier.snapshot()
+            ducked_keys = key_state.snapshot()
+
+            key_state.release_key('+duck')
+            # The unducked trajectory, the soldier is at tick jump_tick + 1
+            for jump_tick in range(unduck_tick, horizon - 1):
+                if soldier.b_on_ground:
+                    break
+                unducked = soldier.snapshot()
+                unducked_keys = key_state.snapshot()
+
+                key_state.press_key('+jump')
+                del detected[:]
+                soldier.simulate_tick()
+                if detected:
+                    results.append(Jumpbug(unduck_tick, jump_tick, soldier.vel[2]))
+
+                soldier.restore(unducked)
+                key_state.restore(unducked_keys)
+                soldier.simulate_tick()
+
+            soldier.restore(ducked)
+            key_state.restore(ducked_keys)
+            soldier.simulate_tick()
+    finally:
+        soldier.hook = soldier.hook # Rebuilds the dispatch
+        soldier.restore(root)
+        key_state.restore(root_keys)
+    return results
@@ -0,0 +1,111 @@
+"""
+    Simulation sessions with checkpoints.
+
+    A session runs a soldier through an input timeline, and saves a checkpoint
+    (Soldier.snapshot, which includes the rockets, plus Key_state.snapshot) every
+    checkpoint_every ticks. When the inputs are edited, the simulation resumes
+    from the last checkpoint before the first changed tick instead of from the start.
+    This makes tuning a single input of a long script (e.g. example 13) fast.
+
+    Smaller checkpoint_every means less re-simulation after an edit, but more memory.
+
+    Usage
+        session = Simulation_session(p, script, ticks = 1600, checkpoint_every = 50)
+        session.run()
+        script.events[-1]['tick'] += 1
+        session.edit(script)     # only re-simulates from the checkpoint before the edit
+        print(session.positions[-1], session.resimulated)
+
+    Same as in the examples, the inputs of tick are applied after simulating tick
+    (tick -1 means before the first tick).
+
+    Note: The hook is not part of the checkpoints. Hooks that keep their own state
+          (e.g. recording positions) see the re-simulated ticks again.
+"""
+
+from input_script import Input_script, Timeline
+
+def make_timeline(inputs):
+    if isinstance(inputs, Input_script):
+        return inputs.compile()
+    if isinstance(inputs, Timeline):
+        return inputs
+    return Timeline(inputs)
+
+# The first tick whose inputs differ between two timelines, None if they are the same
+def first_difference(a, b):
+    n = max(len(a.changes), len(b.changes))
+    for i in range(n):
+        changes_a = a.changes[i] if i < len(a.changes) else []
+        changes_b = b.changes[i] if i < len(b.changes) else []
+        if changes_a != changes_b:
+            return i - 1
+    return None
+
+class Simulation_session:
+    def __init__(self, soldier, inputs = (), ticks = 1000, checkpoint_every = 100):
+        if checkpoint_every < 1:
+            raise ValueError('checkpoint_every has to be at least 1')
+        self.soldier = soldier
+        self.timeline = make_timeline(inputs)
+        self.ticks = ticks
+        self.checkpoint_every = checkpoint_every
+        # tick -> state after simulating tick - 1, before the inputs of tick - 1 are applied
+        self.checkpoints = {0 : self.save()}
+        # Number of ticks simulated so far. The soldier is always in the same kind of
+        # state as a checkpoint, i.e. the inputs of tick - 1 are applied next.
+        self.tick = 0
+        # positions[tick] is the position of the soldier after simulating tick
+        self.positions = []
+        # Number of ticks simulated by the last run
+        self.resimulated = 0
+
+    def save(self):
+        return self.soldier.snapshot(), self.soldier.key_state.snapshot()
+
+    def load(self, tick):
+        state, keys = self.checkpoints[tick]
+        self.soldier.restore(state)
+        self.soldier.key_state.restore(keys)
+        self.tick = tick
+        del self.positions[tick:]
+
+    # Simulates until ticks (default self.ticks) ticks have been simulated
+    def run(self, ticks = None):
+        if ticks is not None:
+            self.ticks = ticks
+        if self.tick > self.ticks:
+            self.load(max(t for t in self.checkpoints if t <= self.ticks))
+
+        soldier = self.soldier
+        timeline = self.timeline
+        start = self.tick
+        for tick in range(self.tick, self.ticks):
+            timeline.apply(soldier, tick - 1)
+            soldier.simulate_tick()
+            self.positions.append(list(soldier.pos))
+            if (tick + 1) % self.checkpoint_every == 0:
+                self.checkpoints[tick + 1] = self.save()
+        self.tick = max(self.tick, self.ticks)
+        self.resimulated = self.tick - start
+        return soldier
+
+    # Replaces the inputs, and re-simulates from the last checkpoint before the first changed tick.
+    # Returns the tick the simulation was resumed from.
+    def edit(self, inputs):
+        timeline = make_timeline(inputs)
+        changed = first_difference(self.timeline, timeline)
+        self.timeline = timeline
+        if changed is None:
+            self.resimulated = 0
+            return self.tick
+        # Inputs of tick changed are applied right before tick changed + 1 is simulated
+        if changed + 1 >= self.tick:
+            resume = self.tick
+        else:
+            resume = max(t for t in self.checkpoints if t <= changed + 1)
+            for t in [t for t in self.checkpoints if t > resume]:
+                del self.checkpoints[t]
+            self.load(resume)
+        self.run()
+        return resume
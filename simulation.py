@@ -8,11 +8,28 @@ float_mode = True
     Useful math functions
 """
 
-from math import sqrt
+from math import ceil, sqrt
+from struct import Struct
+import heapq
+
+# Smallest normal float and largest finite float
+FLT_MIN = 2.0**-126
+FLT_MAX = 3.4028234663852886e+38
+
+_float_struct = Struct('f')
+_pack_float = _float_struct.pack
+_unpack_float = _float_struct.unpack
 
 def round_to_nearest_float(x):
     # Rounds a double to closest float representation
     # Should be equivalent to cast to float in C++
+    # Within the range of normal floats, struct does the cast for us
+    if FLT_MIN <= abs(x) <= FLT_MAX or x == 0:
+        return _unpack_float(_pack_float(x))[0]
+    return round_to_nearest_float_frexp(x)
+
+def round_to_nearest_float_frexp(x):
+    # Keeps 24 bits of mantissa, also for subnormals and values too large for a float
     import math
     m,e = math.frexp(x)
     m *= 2**24
@@ -24,6 +41,10 @@ def round_to_nearest_float(x):
 def simplespline(x):
     return 3 * x**2 - 2 * x**3
 
+# Euclidean length of a vector
+def length(v):
+    return sqrt(sum(x**2 for x in v))
+
 def truncate(x, xmin, xmax):
     if x < xmin:
         return xmin
@@ -100,6 +121,8 @@ available_keys = {
     }
 
 class Key_state:
+    __slots__ = ('mem',)
+
     def __init__(self):
         self.mem = {key:0.0 for key in available_keys}
 
@@ -126,6 +149,12 @@ class Key_state:
     def __getitem__(self, key):
         return self.mem[key]
 
+    def snapshot(self):
+        return tuple(self.mem.items())
+
+    def restore(self, state):
+        self.mem = dict(state)
+
 """
     The base hook class
     This lists all available "hooks", i.e.
@@ -257,62 +286,319 @@ class Hook_Base:
     def soldier_crouched_bounce_detected(self, soldier, explosion_dir, modified_damage, explosion_pos): pass
     def soldier_standing_bounce_detected(self, soldier, explosion_dir, modified_damage, explosion_pos): pass
 
+"""
+    The hook dispatch.
+    When a hook is attached (rocket.hook = ..., player.hook = ...)
+    it is looked up which of the Hook_Base methods the hook overrides.
+    These are stored as bound methods in obj.dispatch, all other hooks are None.
+    This way a hook that only overrides a single method costs
+    (almost) nothing for all of the other call sites.
+
+    Note: The dispatch is built when the hook is attached. If you add
+          methods to the hook afterwards, then re-attach the hook.
+"""
+
+hook_names = [name for name in vars(Hook_Base) if not name.startswith('_')]
+
+class Hook_dispatch:
+    __slots__ = hook_names
+
+    def __init__(self, hook = None):
+        for name in hook_names:
+            setattr(self, name, getattr(hook, name, None) if self.overrides(hook, name) else None)
+
+    @staticmethod
+    def overrides(hook, name):
+        # True if hook has its own version of Hook_Base.name
+        if hook is None:
+            return False
+        if name in getattr(hook, '__dict__', ()):
+            return True
+        return getattr(type(hook), name, None) is not getattr(Hook_Base, name)
+
 
 """
     The rocket class and the Standard_rocket. Has support for hooking.
 
     A simple class for keeping track of rockets and 
     doing basic collision checking with an infinitely large floor.
+
+    Rockets fly in a straight line, so when and where a rocket explodes is
+    solved for as soon as the rocket is created (see solve_impact).
+    This makes simulate_tick O(1). The position of the rocket is only
+    computed when rocket.pos is read.
+
+    Rockets that fly almost parallel to the floor can take very long to hit it.
+    The impact is only solved up to solve_ahead ticks ahead, after that the rocket
+    is solved again when it gets there. A rocket whose height stops changing
+    (the movement is lost to rounding) never explodes.
+
+    Note: Assigning to pos, vel or floor re-solves the impact.
+          Modifying the pos/vel lists in place does not.
 """
 
 rocket_id = 0 # A unique identified for each rocket
 class Rocket:
+    __slots__ = ('_pos', '_pos_tick', '_vel', '_floor', '_hook', 'dispatch', 'ticks_alive', 'scheduler',
+                 'explosion_tick', 'explosion_pos', 'rocket_id')
+    # Number of ticks solve_impact replays at most
+    solve_ahead = 1000
+
     def __init__(self, rocket_pos, rocket_vel, floor, hook = None):
-        self.pos = rocket_pos
-        self.vel = rocket_vel
-        self.floor = floor
+        self._vel = rocket_vel
+        self._floor = floor
         self.hook = hook
+        # Number of ticks the rocket has moved
+        self.ticks_alive = 0
+        # Set when the rocket is added to a Rocket_scheduler
+        self.scheduler = None
+        self.pos = rocket_pos
         
         global rocket_id
         self.rocket_id = rocket_id
         rocket_id += 1
 
-        if self.hook: self.hook.rocket_creation(self)
-
-    def simulate_tick(self):
-        if self.hook: self.hook.rocket_before_tick_update(self)
-        t = (self.floor.z - self.pos[2]) / self.vel[2]
-        speed = sqrt(sum(x**2 for x in self.vel))
+        if self.dispatch.rocket_creation: self.dispatch.rocket_creation(self)
+
+    @property
+    def hook(self):
+        return self._hook
+
+    @hook.setter
+    def hook(self, hook):
+        self._hook = hook
+        self.dispatch = Hook_dispatch(hook)
+
+    @property
+    def pos(self):
+        # Catch up with the ticks the rocket has moved since pos was last computed
+        while self._pos_tick < self.ticks_alive:
+            self._pos = self.move(self._pos)
+            self._pos_tick += 1
+        return self._pos
+
+    @pos.setter
+    def pos(self, value):
+        self._pos = value
+        self._pos_tick = self.ticks_alive
+        self.solve_impact()
+
+    @property
+    def vel(self):
+        return self._vel
+
+    @vel.setter
+    def vel(self, value):
+        self.pos # Positions up until now use the old velocity
+        self._vel = value
+        self.solve_impact()
+
+    @property
+    def floor(self):
+        return self._floor
+
+    @floor.setter
+    def floor(self, value):
+        self._floor = value
+        self.solve_impact()
+
+    # Position after moving one tick
+    def move(self, pos):
+        pos = [pos[i] + self._vel[i] * tick_duration for i in range(3)]
+        if float_mode:
+            pos = [round_to_nearest_float(x) for x in pos]
+        return pos
+
+    # Replays the movement of the rocket to find the tick it explodes and the explosion position
+    # Sets explosion_tick (value of ticks_alive when it explodes) and explosion_pos
+    # Both are None if the rocket never hits the floor
+    # If the rocket does not hit the floor within solve_ahead ticks, explosion_tick is the tick
+    # it has to be solved again and explosion_pos is None (see simulate_tick)
+    def solve_impact(self):
+        self.explosion_tick = self.explosion_pos = None
+        vel = self._vel
+        if vel[2] == 0.0:
+            return
+        floor_z = self._floor.z
+        pos = self.pos
+        ticks = self.ticks_alive
+
+        t = (floor_z - pos[2]) / vel[2]
+        # The rocket moves tick_duration closer every tick
+        while t > tick_duration:
+            if ticks - self.ticks_alive == self.solve_ahead:
+                self.explosion_tick = ticks
+                if self.scheduler: self.scheduler.schedule(self)
+                return
+            moved = self.move(pos)
+            if moved[2] == pos[2]:
+                # Too slow to change the height, the rocket stays at this height forever
+                return
+            pos = moved
+            ticks += 1
+            t = (floor_z - pos[2]) / vel[2]
 
         # Hit happens during tick update
         if 0 < t <= tick_duration:
             # From reading review.pdf, I thought this would 
             # be the prpoper collsion code. But it doesn't match in-game
             # Move to 0.03125 units before wall
-            t = max(0.0, t - COORD_RESOLUTION / speed)
-            explosion_pos = [self.pos[i] + self.vel[i] * t for i in range(3)]
+            t = max(0.0, t - COORD_RESOLUTION / length(vel))
+            explosion_pos = [pos[i] + vel[i] * t for i in range(3)]
 
             # CTFBaseRocket::Explode
             # Go 1 extra unit out from plane
             explosion_pos[2] += 1.0
 
-            if self.hook: self.hook.rocket_exploded(self, list(explosion_pos))
-            return True, explosion_pos
+            self.explosion_tick = ticks
+            self.explosion_pos = explosion_pos
+
+        if self.scheduler: self.scheduler.schedule(self)
+
+    # Generates the positions of the rocket, from its current position until it explodes
+    # Note: Never ends if the rocket never hits the floor
+    def trajectory(self):
+        pos = self.pos
+        vel = self._vel
+        floor_z = self._floor.z
+        while not (vel[2] != 0.0 and 0 < (floor_z - pos[2]) / vel[2] <= tick_duration):
+            yield list(pos)
+            pos = self.move(pos)
+        yield list(pos)
+
+    # A copy of the state of the rocket, see Player.snapshot
+    def snapshot(self):
+        return (tuple(self._pos), self._pos_tick, tuple(self._vel), self._floor, self.ticks_alive,
+                self.explosion_tick, self.explosion_pos and tuple(self.explosion_pos))
+
+    # Note: Does not re-solve the impact nor notify the scheduler
+    def restore(self, state):
+        (pos, self._pos_tick, vel, self._floor, self.ticks_alive,
+            self.explosion_tick, explosion_pos) = state
+        self._pos = list(pos)
+        self._vel = list(vel)
+        self.explosion_pos = explosion_pos and list(explosion_pos)
 
-        for i in range(3):
-            self.pos[i] += self.vel[i] * tick_duration
+    def simulate_tick(self):
+        if self.dispatch.rocket_before_tick_update: self.dispatch.rocket_before_tick_update(self)
 
-        if float_mode:
-            for i in range(3):
-                self.pos[i] = round_to_nearest_float(self.pos[i])
-        if self.hook: self.hook.rocket_after_tick_update(self)
+        # The impact was only solved up until now
+        if self.ticks_alive == self.explosion_tick and self.explosion_pos is None:
+            self.solve_impact()
+
+        # Hit happens during tick update
+        if self.ticks_alive == self.explosion_tick and self.explosion_pos is not None:
+            explosion_pos = list(self.explosion_pos)
+            if self.dispatch.rocket_exploded: self.dispatch.rocket_exploded(self, list(explosion_pos))
+            return True, explosion_pos
+
+        self.ticks_alive += 1
+        if self.dispatch.rocket_after_tick_update: self.dispatch.rocket_after_tick_update(self)
         return False, None
 
 class Standard_rocket(Rocket):
+    __slots__ = ()
     explosion_damage = 90.0
     explosion_radius = 121.0
     rocket_speed = 1100.0
 
+"""
+    The rocket scheduler. Keeps track of the active rockets of a soldier.
+
+    Since the explosion tick of every rocket is known when it is created,
+    rockets are kept in a heap ordered by (explosion tick, rocket_id).
+    A rocket is only updated on the tick it explodes, and ticks without
+    any explosions cost nothing. Explosions during the same tick happen in
+    order of creation, same as when every rocket was updated every tick.
+
+    Rockets whose hook overrides rocket_before_tick_update or
+    rocket_after_tick_update are updated every tick, so those hooks are still called.
+
+    Note: ticks_alive (and therefore pos) of a rocket is only brought up to date
+          when the rocket is accessed through the scheduler.
+"""
+
+
+class Rocket_scheduler:
+    def __init__(self):
+        # Number of finished rocket updates
+        self.tick = 0
+        # Heap of (value of tick when the rocket explodes, rocket_id, rocket)
+        self.queue = []
+        # rocket_id -> (rocket, value of tick when rocket was added), in order of creation
+        self.rockets = {}
+        # Rockets that are updated every tick, rocket_id -> rocket
+        self.watched = {}
+
+    def __len__(self):
+        return len(self.rockets)
+
+    # The active rockets, in order of creation
+    def __iter__(self):
+        for rocket_id in list(self.rockets):
+            yield self.sync(self.rockets[rocket_id][0])
+
+    def add(self, rocket):
+        self.rockets[rocket.rocket_id] = (rocket, self.tick)
+        rocket.scheduler = self
+        if rocket.dispatch.rocket_before_tick_update or rocket.dispatch.rocket_after_tick_update:
+            self.watched[rocket.rocket_id] = rocket
+        self.schedule(rocket)
+
+    def remove(self, rocket):
+        del self.rockets[rocket.rocket_id]
+        self.watched.pop(rocket.rocket_id, None)
+        rocket.scheduler = None
+
+    def clear(self):
+        for rocket in list(self):
+            self.remove(rocket)
+        self.queue = []
+
+    # Called whenever the explosion tick of a rocket changes
+    # Note: Old entries of the rocket stay in the heap, they are skipped when popped
+    def schedule(self, rocket):
+        if rocket.explosion_tick is not None:
+            heapq.heappush(self.queue, (self.rockets[rocket.rocket_id][1] + rocket.explosion_tick, rocket.rocket_id, rocket))
+
+    # Bring ticks_alive of the rocket up to date
+    def sync(self, rocket):
+        rocket.ticks_alive = self.tick - self.rockets[rocket.rocket_id][1]
+        return rocket
+
+    # The rockets that need to be updated this tick, in order of creation
+    def due(self):
+        queue = self.queue
+        if not self.watched and (not queue or queue[0][0] > self.tick):
+            return ()
+
+        due = dict(self.watched)
+        while queue and queue[0][0] <= self.tick:
+            explosion_tick, rocket_id, rocket = heapq.heappop(queue)
+            if rocket_id in self.rockets and rocket.explosion_tick is not None \
+                    and self.rockets[rocket_id][1] + rocket.explosion_tick == explosion_tick:
+                due[rocket_id] = rocket
+        return [self.sync(due[rocket_id]) for rocket_id in sorted(due)]
+
+    def finish_tick(self):
+        self.tick += 1
+
+    # A copy of the scheduler and all of its rockets, see Player.snapshot
+    def snapshot(self):
+        return (self.tick, tuple(self.queue), tuple(self.rockets.items()),
+                tuple((rocket, rocket.snapshot()) for rocket, _ in self.rockets.values()))
+
+    def restore(self, state):
+        self.tick, queue, rockets, rocket_states = state
+        self.queue = list(queue)
+        self.rockets = dict(rockets)
+        self.watched = {}
+        for rocket, rocket_state in rocket_states:
+            rocket.restore(rocket_state)
+            rocket.scheduler = self
+            if rocket.dispatch.rocket_before_tick_update or rocket.dispatch.rocket_after_tick_update:
+                self.watched[rocket.rocket_id] = rocket
+
 """
     The rocket-launcher classes
 
@@ -345,9 +631,21 @@ class Mangler(Rocket_launcher):
     The physics object that can be interacted with is an
     infinitely large plane. If you want to change which plane
     is used between ticks, then you are intended to make use of hooks.
+
+    The state of a player can be saved with state = player.snapshot()
+    and rolled back with player.restore(state). Snapshots are tuples that refer
+    to the floor (and for soldiers the launcher and the rockets) by object, so they
+    only compare equal for the same objects. Use transposition.state_hash to find
+    states that have already been visited.
+    Note: The key_state and the hook are not part of the snapshot.
 """
 
 class Player:
+    __slots__ = ('key_state', '_hook', 'dispatch',
+                 'pos', 'vel', 'angle', 'b_ducked', 'b_ducking', 'b_on_ground', 'floor',
+                 'forward_2D', 'right_2D', 'grip', 'b_crop_speed_ducking', 'duck_animation', 'reduck_timer',
+                 'b_prev_tick_duck_pressed', 'airduck_counter', 'b_prev_tick_jump_pressed', 'z_eye_offset')
+
     def __init__(self, 
             key_state,
             hook = None,
@@ -398,11 +696,40 @@ class Player:
 
         self.z_eye_offset = self.view_height_ducked if self.b_ducked else self.view_height_standing
 
-        if self.hook: self.hook.player_created(self)
+        if self.dispatch.player_created: self.dispatch.player_created(self)
+
+    @property
+    def hook(self):
+        return self._hook
+
+    @hook.setter
+    def hook(self, hook):
+        self._hook = hook
+        self.dispatch = Hook_dispatch(hook)
+
+    def snapshot(self):
+        return (tuple(self.pos), tuple(self.vel), self.angle,
+                self.b_ducked, self.b_ducking, self.b_on_ground, self.floor,
+                tuple(self.forward_2D), tuple(self.right_2D), self.grip,
+                self.b_crop_speed_ducking, self.duck_animation, self.reduck_timer,
+                self.b_prev_tick_duck_pressed, self.airduck_counter, self.b_prev_tick_jump_pressed,
+                self.z_eye_offset)
+
+    def restore(self, state):
+        (pos, vel, self.angle,
+            self.b_ducked, self.b_ducking, self.b_on_ground, self.floor,
+            forward_2D, right_2D, self.grip,
+            self.b_crop_speed_ducking, self.duck_animation, self.reduck_timer,
+            self.b_prev_tick_duck_pressed, self.airduck_counter, self.b_prev_tick_jump_pressed,
+            self.z_eye_offset) = state
+        self.pos = list(pos)
+        self.vel = list(vel)
+        self.forward_2D = list(forward_2D)
+        self.right_2D = list(right_2D)
 
     def set_ground_state(self, value):
         if value:
-            if self.hook and not self.b_on_ground: self.hook.player_air_to_ground(self)
+            if self.dispatch.player_air_to_ground and not self.b_on_ground: self.dispatch.player_air_to_ground(self)
             # CGameMovement::SetGroundEntity in shared/gamemovement.cpp
             if not self.b_on_ground:
                 if self.hook: self.hook.landed_this_tick = True
@@ -410,7 +737,7 @@ class Player:
             self.b_on_ground = True
             self.airduck_counter = 0
         else:
-            if self.hook and self.b_on_ground: self.hook.player_ground_to_air(self)
+            if self.dispatch.player_ground_to_air and self.b_on_ground: self.dispatch.player_ground_to_air(self)
             self.b_on_ground = False
     
     def categorize_position(self):
@@ -423,9 +750,9 @@ class Player:
                 if self.pos[2] - self.floor.z < 2.0 + sv_stepsize: # Floor within 2 units + stepsize
                     traced_dist_to_floor = self.pos[2] - (self.floor.z + COORD_RESOLUTION)
                     if self.b_on_ground and traced_dist_to_floor > 0.5 * COORD_RESOLUTION:
-                        if self.hook: self.hook.player_before_teleport_to_ground(self)
+                        if self.dispatch.player_before_teleport_to_ground: self.dispatch.player_before_teleport_to_ground(self)
                         self.pos[2] = self.floor.z + COORD_RESOLUTION
-                        if self.hook: self.hook.player_after_teleport_to_ground(self)
+                        if self.dispatch.player_after_teleport_to_ground: self.dispatch.player_after_teleport_to_ground(self)
                 self.set_ground_state(True)
             elif self.pos[2] - self.floor.z < 2.0: # Floor within 2 units
                 self.set_ground_state(True)
@@ -478,13 +805,13 @@ class Player:
             if b_duck_just_pressed and not self.b_ducked:
                 self.duck_animation = 0.0
                 self.b_ducking = True
-                if self.hook: self.hook.player_ducking(self)
+                if self.dispatch.player_ducking: self.dispatch.player_ducking(self)
 
             if self.b_ducking:
                 if self.duck_animation > DUCKING_TIME or self.b_ducked or not self.b_on_ground:
                     #CGameMovement::FinishDuck
                     if not self.b_ducked:
-                        if self.hook: self.hook.player_before_ducked(self)
+                        if self.dispatch.player_before_ducked: self.dispatch.player_before_ducked(self)
                         self.b_ducked = True
                         self.b_ducking = False
                         self.set_ducked_eye_offset(1.0)
@@ -495,7 +822,7 @@ class Player:
                         else:
                             self.pos[2] += 20.0
                         
-                        if self.hook: self.hook.player_after_ducked(self)
+                        if self.dispatch.player_after_ducked: self.dispatch.player_after_ducked(self)
                         self.categorize_position()
                 else:
                     duck_fraction = simplespline(self.duck_animation / DUCKING_TIME)
@@ -507,7 +834,7 @@ class Player:
                 self.reduck_timer = 0.0
                 if not self.b_on_ground:
                     self.airduck_counter += 1
-                    if self.hook: self.hook.player_airduck_counter_increase(self)
+                    if self.dispatch.player_airduck_counter_increase: self.dispatch.player_airduck_counter_increase(self)
             
             # Weird logic, but this is how tf2 source is coded
             if True or not self.b_on_ground or self.b_ducking:
@@ -520,24 +847,24 @@ class Player:
                 if self.can_unduck():
                     if self.b_ducking or self.b_ducked:
                         if self.duck_animation > UNDUCKING_TIME or not self.b_on_ground:
-                            if self.hook and self.b_ducked: self.hook.player_before_unduck(self)
+                            if self.dispatch.player_before_unduck and self.b_ducked: self.dispatch.player_before_unduck(self)
                             was_ducked = self.b_ducked
                             # CGameMovement::FinishUnDuck
                             if self.b_on_ground:
                                 pass
                                 # TODO: Grounded unduck
                             else:
-                                if self.hook and not self.b_ducked: self.hook.player_before_ctap(self)
+                                if self.dispatch.player_before_ctap and not self.b_ducked: self.dispatch.player_before_ctap(self)
                                 self.pos[2] -= 20.0
                                 # TODO: Air unduck
-                                if self.hook and not self.b_ducked: self.hook.player_after_ctap(self)
+                                if self.dispatch.player_after_ctap and not self.b_ducked: self.dispatch.player_after_ctap(self)
 
                             self.b_ducked = False
                             self.b_ducking = False
                             self.duck_animation = 10.0
                             self.set_ducked_eye_offset(0.0)
 
-                            if self.hook and was_ducked: self.hook.player_after_unduck(self)
+                            if self.dispatch.player_after_unduck and was_ducked: self.dispatch.player_after_unduck(self)
                             self.categorize_position()
                         else:
                             self.b_ducking = True
@@ -552,31 +879,54 @@ class Player:
     #CGameMovement::PlayerMove
     def simulate_tick(self):
         if self.hook: self.hook.landed_this_tick = False
-        if self.hook: self.hook.player_before_tick_update(self)
+        if self.dispatch.player_before_tick_update: self.dispatch.player_before_tick_update(self)
         # CGameMovement::PlayerMove in shared/gamemovement.cpp
         if False: # TODO should this be false or true? Seems likely false
             self.categorize_position()
         elif self.vel[2] > 250.0:
             self.set_ground_state(False)
         
-        if self.hook and 0.0 < self.pos[2] - self.floor.z - 20.0 <= 2.0 and self.b_ducked and self.vel[2] <= 0.0:
-            self.hook.player_jumpbug_possible(self)
+        if self.dispatch.player_jumpbug_possible and 0.0 < self.pos[2] - self.floor.z - 20.0 <= 2.0 and self.b_ducked and self.vel[2] <= 0.0:
+            self.dispatch.player_jumpbug_possible(self)
 
-        if self.hook: was_ducked_and_in_air_initially = self.b_ducked and not self.b_on_ground
+        was_ducked_and_in_air_initially = self.b_ducked and not self.b_on_ground
         self.handle_ducking()
 
         # CTFGameMovement::FullWalkMove in tf/tf_gamemovement
         half_grav = sv_gravity * 0.5 * tick_duration
 
+        self.start_gravity(half_grav)
+       
+        if self.dispatch.player_bhop_possible and self.b_on_ground and 1.0 < self.pos[2] - self.floor.z <= 2.0 and not self.b_ducked:
+            self.dispatch.player_bhop_possible(self)
+        
+        self.check_jump_button(half_grav, was_ducked_and_in_air_initially)
+
+        if self.b_on_ground:
+            self.vel[2] = 0.0
+            self.friction()
+            if self.dispatch.player_before_walkmove: self.dispatch.player_before_walkmove(self)
+            self.walkmove()
+            if self.dispatch.player_after_walkmove: self.dispatch.player_after_walkmove(self)
+        else:
+            if self.dispatch.player_before_airmove: self.dispatch.player_before_airmove(self)
+            self.airmove()
+            if self.dispatch.player_after_airmove: self.dispatch.player_after_airmove(self)
+ 
+        self.categorize_position()
+
+        self.finish_gravity(half_grav)
+        
+        if self.dispatch.player_after_tick_update: self.dispatch.player_after_tick_update(self)
+
+    def start_gravity(self, half_grav):
         # CGameMovement::StartGravity in shared/gamemovement.cpp
         # CGameMovement::CheckVelocity in shared/gamemovement.cpp
         self.vel[2] = truncate(self.vel[2] - half_grav, -max_vel, max_vel)
         self.vel[0] = truncate(self.vel[0], -max_vel, max_vel)
         self.vel[1] = truncate(self.vel[1], -max_vel, max_vel)
-       
-        if self.hook and self.b_on_ground and 1.0 < self.pos[2] - self.floor.z <= 2.0 and not self.b_ducked:
-            self.hook.player_bhop_possible(self)
-        
+
+    def check_jump_button(self, half_grav, was_ducked_and_in_air_initially):
         b_jump_pressed = self.key_state['+jump'] > 0
         b_jump_just_pressed = b_jump_pressed and not self.b_prev_tick_jump_pressed
         self.b_prev_tick_jump_pressed = b_jump_pressed
@@ -588,14 +938,14 @@ class Player:
                     if not self.b_on_ground:
                         pass
                     else:
-                        if self.hook: self.hook.player_before_jump(self)
+                        if self.dispatch.player_before_jump: self.dispatch.player_before_jump(self)
                         #CTFGameMovement::PreventBunnyJumping in tf/tf_gamemovement
-                        speed = sqrt(sum(x**2 for x in self.vel))
+                        speed = length(self.vel)
                         if speed >= BUNNYJUMP_MAX_SPEED_FACTOR * self.flMaxSpeed:
-                            if self.hook: self.hook.player_before_bunnyhop_detected(self)
+                            if self.dispatch.player_before_bunnyhop_detected: self.dispatch.player_before_bunnyhop_detected(self)
                             scale = BUNNYJUMP_MAX_SPEED_FACTOR * self.flMaxSpeed / speed
                             self.vel = [x * scale for x in self.vel]
-                            if self.hook: self.hook.player_after_bunnyhop_detected(self)
+                            if self.dispatch.player_after_bunnyhop_detected: self.dispatch.player_after_bunnyhop_detected(self)
                         
                         self.set_ground_state(False)
 
@@ -604,26 +954,14 @@ class Player:
                             self.vel[2] = truncate(              jump_speed - half_grav, -max_vel, max_vel)
                         else:
                             self.vel[2] = truncate(self.vel[2] + jump_speed - half_grav, -max_vel, max_vel)
-                        if self.hook: self.hook.player_after_jump(self)
+                        if self.dispatch.player_after_jump: self.dispatch.player_after_jump(self)
 
-                        if self.hook and was_ducked_and_in_air_initially:
-                            self.hook.player_jumpbug_detected(self)
-                        if self.hook and 1.0 < self.pos[2] - self.floor.z <= 2.0:
-                            self.hook.player_bhop_detected(self)
-
-        if self.b_on_ground:
-            self.vel[2] = 0.0
-            self.friction()
-            if self.hook: self.hook.player_before_walkmove(self)
-            self.walkmove()
-            if self.hook: self.hook.player_after_walkmove(self)
-        else:
-            if self.hook: self.hook.player_before_airmove(self)
-            self.airmove()
-            if self.hook: self.hook.player_after_airmove(self)
- 
-        self.categorize_position()
+                        if self.dispatch.player_jumpbug_detected and was_ducked_and_in_air_initially:
+                            self.dispatch.player_jumpbug_detected(self)
+                        if self.dispatch.player_bhop_detected and 1.0 < self.pos[2] - self.floor.z <= 2.0:
+                            self.dispatch.player_bhop_detected(self)
 
+    def finish_gravity(self, half_grav):
         # CGameMovement::FinishGravity in shared/gamemovement.cpp
         self.vel[2] = truncate(self.vel[2] - half_grav, -max_vel, max_vel)
         if self.b_on_ground:
@@ -632,8 +970,142 @@ class Player:
         # Check to stop player from going faster than 3500 (could happen as a result of air strafing)
         self.vel[0] = truncate(self.vel[0], -max_vel, max_vel)
         self.vel[1] = truncate(self.vel[1], -max_vel, max_vel)
-        
-        if self.hook: self.hook.player_after_tick_update(self)
+
+    """
+        Fast forwarding through the air.
+
+        While the player is airborne, has no wishspeed and the duck state is not
+        about to change, a tick only applies gravity and moves the player.
+        fast_forward_until_event advances these ticks in a tight loop, without
+        calling simulate_tick. The result is identical to calling simulate_tick,
+        except that no hooks are called for the skipped ticks.
+
+        It stops right before the tick on which one of the following happen
+            'apex' the next tick is the last tick the player moves upwards
+            'jumpbug_window' player_jumpbug_possible would be called next tick
+            'landing' the player lands during the next tick
+        Note: The player is always stopped before landing, even if 'landing' is not in events
+    """
+
+    # True if the player would only move ballistically through the air next tick
+    def can_fast_forward(self):
+        if self.b_on_ground or self.b_ducking:
+            return False
+        b_duck_pressed = self.key_state['+duck'] > 0 and self.airduck_counter < AIRDUCK_LIMIT
+        if b_duck_pressed != self.b_prev_tick_duck_pressed:
+            return False
+        # Releasing duck in the air results in an unduck
+        if not b_duck_pressed and self.b_ducked:
+            return False
+        return self.get_wish_speed()[0] == 0.0
+
+    # Closed form estimate of the number of ticks fast_forward_until_event would advance for each event.
+    # This ignores float rounding, so it can be off by a tick. None if the event won't happen.
+    def predict_air_events(self):
+        half_grav = sv_gravity * 0.5 * tick_duration
+        # The vertical speed used for moving during the next tick, same as in simulate_tick
+        # Only the first tick can be clamped from above, the speed only gets smaller afterwards
+        a = truncate(self.vel[2] - half_grav, -max_vel, max_vel)
+        dz = self.pos[2] - self.floor.z
+        # The first tick that the player moves down at max_vel
+        terminal = max(0, ceil((a + max_vel) / (2.0 * half_grav)))
+
+        # After n <= terminal ticks, the player is dz + tick_duration * (n * a - half_grav * n * (n - 1)) above the floor,
+        # afterwards the player falls max_vel * tick_duration every tick
+        def height(n):
+            return dz + tick_duration * (n * a - half_grav * n * (n - 1))
+
+        # This finds the first n such that the player is at most h units above the floor
+        def ticks_until_height(h):
+            if dz <= h:
+                return 0
+            b = a + half_grav
+            n = ceil((b + sqrt(b * b + 4.0 * half_grav * (dz - h) / tick_duration)) / (2.0 * half_grav))
+            if n <= terminal:
+                return n
+            return terminal + ceil((height(terminal) - h) / (max_vel * tick_duration))
+
+        # The last tick with a > 2 * half_grav * n
+        apex = int(a / (2.0 * half_grav)) if a > 0.0 else None
+        if apex is not None and a == 2.0 * half_grav * apex:
+            apex -= 1
+
+        landing = ticks_until_height(2.0)
+        return {
+            'apex' : apex,
+            'jumpbug_window' : ticks_until_height(22.0) if self.b_ducked else None,
+            'landing' : max(0, landing - 1),
+        }
+
+    def fast_forward_until_event(self, events = ('apex', 'jumpbug_window', 'landing'), max_ticks = 100000):
+        if not self.can_fast_forward():
+            return 0, None
+
+        # No need to check for events until close to the predicted ones
+        predicted = self.predict_air_events()
+        safe_ticks = min([predicted[event] for event in events if predicted[event] is not None] + [max_ticks]) - 5
+
+        half_grav = sv_gravity * 0.5 * tick_duration
+        floor_z = self.floor.z
+        x, y, z = self.pos
+        vz = self.vel[2]
+        grip = self.grip
+        duck_animation = self.duck_animation
+        reduck_timer = self.reduck_timer
+        check_apex = 'apex' in events
+        check_jumpbug = 'jumpbug_window' in events and self.b_ducked
+        rounded = round_to_nearest_float if float_mode else float
+
+        # The horizontal speed stays the same after being rounded once by airmove
+        vx = rounded(truncate(self.vel[0], -max_vel, max_vel))
+        vy = rounded(truncate(self.vel[1], -max_vel, max_vel))
+        dx = vx * tick_duration
+        dy = vy * tick_duration
+
+        ticks = 0
+        event = None
+        while ticks < max_ticks:
+            checked = ticks >= safe_ticks
+            if checked and check_jumpbug and vz <= 0.0 and 0.0 < z - floor_z - 20.0 <= 2.0:
+                event = 'jumpbug_window'
+                break
+
+            # Same as simulate_tick, see handle_ducking, airmove and categorize_position
+            nvz = rounded(truncate(vz - half_grav, -max_vel, max_vel))
+            nz = z + nvz * tick_duration
+            if nz < floor_z:
+                nz = floor_z + COORD_RESOLUTION
+            nz = rounded(nz)
+
+            if nvz <= 250.0 and nz - floor_z < 2.0:
+                event = 'landing'
+                break
+
+            end_vz = truncate(nvz - half_grav, -max_vel, max_vel)
+            if checked and check_apex and nvz > 0.0 and rounded(truncate(end_vz - half_grav, -max_vel, max_vel)) <= 0.0:
+                event = 'apex'
+                break
+
+            x = rounded(x + dx)
+            y = rounded(y + dy)
+            z = nz
+            vz = end_vz
+            grip = 0.25 if 0.0 < nvz <= 250.0 else 1.0
+            duck_animation += tick_duration
+            reduck_timer += tick_duration
+            ticks += 1
+        else:
+            event = 'max_ticks'
+
+        if ticks:
+            self.pos = [x, y, z]
+            self.vel = [vx, vy, vz]
+            self.grip = grip
+            self.duck_animation = duck_animation
+            self.reduck_timer = reduck_timer
+            self.b_crop_speed_ducking = False
+            self.b_prev_tick_jump_pressed = self.key_state['+jump'] > 0
+        return ticks, event
 
     def get_wish_speed(self):
         # CInput::ComputeForwardMove in client/in_main.cpp
@@ -665,14 +1137,14 @@ class Player:
         for i in range(2):
             wish_2D_vec[i] += self.forward_2D[i] * forward_wish + self.right_2D[i] * side_wish
         
-        wishspeed = sqrt(sum(x**2 for x in wish_2D_vec))
+        wishspeed = length(wish_2D_vec)
         wish_dir = [x/wishspeed if wishspeed else 0.0 for x in wish_2D_vec]
         return wishspeed, wish_dir
 
     
     # CGameMovement::Friction in shared/gamemovement
     def friction(self):
-        speed = sqrt(sum(x**2 for x in self.vel))
+        speed = length(self.vel)
         if speed < 0.1:
             return
         newspeed = max(0.0, speed - sv_friction * self.grip * tick_duration * max(speed, sv_stopspeed))
@@ -682,7 +1154,7 @@ class Player:
     # CTFGameMovement::WalkMove in tf/tf_gamemovement
     def walkmove(self):
         wishspeed, wish_dir = self.get_wish_speed()
-        speed = sqrt(sum(x**2 for x in self.vel))
+        speed = length(self.vel)
 
         if 0.0 < wishspeed < WISHSPEEDTHR:
             accel = max(speed, sv_stopspeed) * sv_friction / wishspeed + 1.0
@@ -697,12 +1169,12 @@ class Player:
             self.vel[1] += diff * wish_dir[1]
 
         # CTFGameMovement::WalkMove in tf/tf_gamemovement
-        newspeed = sqrt(sum(x**2 for x in self.vel))
+        newspeed = length(self.vel)
         if newspeed > self.flMaxSpeed:
             scale = self.flMaxSpeed / newspeed
             self.vel = [x * scale for x in self.vel]
         
-        speed = sqrt(sum(x**2 for x in self.vel))
+        speed = length(self.vel)
         if tf_clamp_back_speed < 1.0 and speed > tf_clamp_back_speed_min:
             flDot = self.forward_2D[0] * self.vel[0] + self.forward_2D[1] * self.vel[1]
             
@@ -715,7 +1187,7 @@ class Player:
         
                 
         # CTFGameMovement::WalkMove in tf/tf_gamemovement
-        speed = sqrt(sum(x**2 for x in self.vel))
+        speed = length(self.vel)
         if speed < 1.0:
             self.vel = [0.0] * 3
             return
@@ -735,7 +1207,7 @@ class Player:
 
     # CTFGameMovement::AirMove in tf/tf_gamemovement
     def airmove(self):
-        if self.hook and self.grip != 1.0: self.hook.player_deadstrafe_detected(self)
+        if self.dispatch.player_deadstrafe_detected and self.grip != 1.0: self.dispatch.player_deadstrafe_detected(self)
         
         wishspeed, wish_dir = self.get_wish_speed()
         
@@ -768,9 +1240,14 @@ class Player:
 """
     The solider class (inherits player- base class). Has support for hooking.
     This handles rockets and explosions.
+
+    The snapshot of a soldier also contains the launcher, fire_cooldown
+    and the active rockets.
 """
 
 class Soldier(Player):
+    __slots__ = ('launcher', 'rocket_scheduler', 'fire_cooldown')
+
     flMaxSpeed = 240
     fire_rate = 0.8
     deploy_speed = 0.5
@@ -785,13 +1262,13 @@ class Soldier(Player):
         self.key_state = key_state
         self.launcher = launcher
 
-        self.active_rockets = []
+        self.rocket_scheduler = Rocket_scheduler()
         self.fire_cooldown = 0.0
         
-        if self.hook: self.hook.soldier_created(self)
+        if self.dispatch.soldier_created: self.dispatch.soldier_created(self)
 
     def shoot_rocket(self):
-        if self.hook: self.hook.soldier_before_shot(self)
+        if self.dispatch.soldier_before_shot: self.dispatch.soldier_before_shot(self)
 
         at_floor = self.floor
 
@@ -820,7 +1297,7 @@ class Soldier(Player):
         for i in range(3):
             aim_at[i] = view_pos[i] + view_dir[i] * dist
         
-        if self.hook: self.hook.soldier_aiming_rocket(self, list(aim_at))
+        if self.dispatch.soldier_aiming_rocket: self.dispatch.soldier_aiming_rocket(self, list(aim_at))
 
         # Compute launcher position using maths
         forward = [.0] * 3
@@ -845,48 +1322,90 @@ class Soldier(Player):
             launcher_pos[i] += forward[i] * self.launcher.offset_forward + right[i] * self.launcher.offset_right + up[i] * up_offset
 
         rocket_vel = [aim_at[i] - launcher_pos[i] for i in range(3)]
-        scale = self.launcher.rocket_type.rocket_speed / sqrt(sum(x**2 for x in rocket_vel))
+        scale = self.launcher.rocket_type.rocket_speed / length(rocket_vel)
         rocket_vel = [x * scale for x in rocket_vel]
         
-        if self.hook: self.hook.soldier_after_shot(self)
+        if self.dispatch.soldier_after_shot: self.dispatch.soldier_after_shot(self)
         
         # Return rocket object
         return self.launcher.rocket_type(launcher_pos, rocket_vel, at_floor, self.hook)
 
+    # The rockets currently flying, in order of creation
+    @property
+    def active_rockets(self):
+        return list(self.rocket_scheduler)
+
+    @active_rockets.setter
+    def active_rockets(self, rockets):
+        self.rocket_scheduler.clear()
+        for rocket in rockets:
+            self.rocket_scheduler.add(rocket)
+
+    def snapshot(self):
+        return super().snapshot() + (self.launcher, self.fire_cooldown, self.rocket_scheduler.snapshot())
+
+    def restore(self, state):
+        super().restore(state[:-3])
+        self.launcher, self.fire_cooldown, rockets = state[-3:]
+        self.rocket_scheduler.restore(rockets)
+
+    # Rockets and firing are not fast forwarded
+    def can_fast_forward(self):
+        if self.rocket_scheduler or self.key_state['+attack'] > 0.0 or self.key_state['shotgun'] > 0.0:
+            return False
+        return super().can_fast_forward()
+
+    def fast_forward_until_event(self, *args, **kwargs):
+        ticks, event = super().fast_forward_until_event(*args, **kwargs)
+        for _ in range(ticks):
+            self.fire_cooldown -= tick_duration
+            self.rocket_scheduler.finish_tick()
+        return ticks, event
+
     def simulate_tick(self):
+        self.simulate_movement()
+        self.update_rockets()
+        self.simulate_weapon()
+        if self.dispatch.soldier_after_tick_update: self.dispatch.soldier_after_tick_update(self)
+
+    # The part of the tick before the rockets are updated
+    def simulate_movement(self):
         super().simulate_tick()
-        if self.hook: self.hook.soldier_before_tick_update(self)
+        if self.dispatch.soldier_before_tick_update: self.dispatch.soldier_before_tick_update(self)
          
-        if self.hook and self.b_on_ground and 1.0 < self.pos[2] - self.floor.z <= 2.0 and self.vel[2] == 0.0: 
-            if self.b_ducked: self.hook.soldier_crouched_bounce_possible(self)
-            else: self.hook.soldier_standing_bounce_possible(self)
-        
-        alive_rockets = []
-        for rocket in self.active_rockets:
-            rocket_exploded, explosion_pos = rocket.simulate_tick()
-            if not rocket_exploded:
-                alive_rockets.append(rocket)
-                continue
-            self.simulate_knockback(explosion_pos, rocket.explosion_damage, rocket.explosion_radius)
+        if self.b_on_ground and 1.0 < self.pos[2] - self.floor.z <= 2.0 and self.vel[2] == 0.0: 
+            if self.b_ducked:
+                if self.dispatch.soldier_crouched_bounce_possible: self.dispatch.soldier_crouched_bounce_possible(self)
+            else:
+                if self.dispatch.soldier_standing_bounce_possible: self.dispatch.soldier_standing_bounce_possible(self)
 
-        self.active_rockets = alive_rockets
-        
+    # The part of the tick after the rockets are updated. Returns the rocket that was shot, if any
+    def simulate_weapon(self):
         # CTFWeaponBase::Deploy
         self.fire_cooldown -= tick_duration
         # Pretend to switch from shotgun to rocket launcher
         if self.key_state['shotgun'] > 0.0:
-            if self.hook: self.hook.soldier_before_weapon_switch(self)
+            if self.dispatch.soldier_before_weapon_switch: self.dispatch.soldier_before_weapon_switch(self)
             self.fire_cooldown = max(self.deploy_speed, self.fire_cooldown)
-            if self.hook: self.hook.soldier_after_weapon_switch(self)
+            if self.dispatch.soldier_after_weapon_switch: self.dispatch.soldier_after_weapon_switch(self)
 
         # Jumpqol makes sure that rockets are never moved the tick they are created.
         # CTFWeaponBaseGun::PrimaryAttack in tf/tf_weaponbase_gun
         if self.key_state['+attack'] > 0.0 and self.fire_cooldown <= 0:
             self.fire_cooldown = self.fire_rate 
-            self.active_rockets.append(self.shoot_rocket())
-        
-        if self.hook: self.hook.soldier_after_tick_update(self)
+            rocket = self.shoot_rocket()
+            self.rocket_scheduler.add(rocket)
+            return rocket
+        return None
 
+    def update_rockets(self):
+        for rocket in self.rocket_scheduler.due():
+            rocket_exploded, explosion_pos = rocket.simulate_tick()
+            if not rocket_exploded:
+                continue
+            self.rocket_scheduler.remove(rocket)
+            self.simulate_knockback(explosion_pos, rocket.explosion_damage, rocket.explosion_radius)
+        self.rocket_scheduler.finish_tick()
 
     def simulate_knockback(self, explosion_pos, explosion_damage, explosion_radius):
         # This is from review.pdf
@@ -908,15 +1427,15 @@ class Soldier(Player):
         bbox_max = [center_pos[i] + bbox[i]/2 for i in range(3)]
 
         closet_point = [truncate(explosion_pos[i], bbox_min[i], bbox_max[i]) for i in range(3)]
-        dist_rocket_to_bbox = sqrt(sum((closet_point[i] - explosion_pos[i])**2 for i in range(3)))
+        dist_rocket_to_bbox = length([closet_point[i] - explosion_pos[i] for i in range(3)])
         
         if dist_rocket_to_bbox > explosion_radius:
-            if self.hook: self.hook.soldier_outside_explosion(self, explosion_pos, explosion_damage, explosion_radius, dist_rocket_to_bbox)
+            if self.dispatch.soldier_outside_explosion: self.dispatch.soldier_outside_explosion(self, explosion_pos, explosion_damage, explosion_radius, dist_rocket_to_bbox)
             return
 
         # Damage is computed using min distance to feet or center
-        dist_rocket_to_center = sqrt(sum((center_pos[i] - explosion_pos[i])**2 for i in range(3)))
-        dist_rocket_to_feet = sqrt(sum((self.pos[i] - explosion_pos[i])**2 for i in range(3)))
+        dist_rocket_to_center = length([center_pos[i] - explosion_pos[i] for i in range(3)])
+        dist_rocket_to_feet = length([self.pos[i] - explosion_pos[i] for i in range(3)])
 
         d = min(dist_rocket_to_center, dist_rocket_to_feet)
         inital_damage = explosion_damage * (1.0 - 0.5 * min(d / explosion_radius, 1.0))
@@ -936,19 +1455,20 @@ class Soldier(Player):
         explosion_pos[2] -= 10.0
 
         explosion_dir = [(center_pos[i] - explosion_pos[i]) for i in range(3)]
-        scale = sqrt(sum(x**2 for x in explosion_dir))
+        scale = length(explosion_dir)
         explosion_dir = [x / scale for x in explosion_dir]
        
-        if self.hook: vspeed_before_explosion = self.vel[2]
-        if self.hook: hspeed_before_explosion = sqrt(sum(self.vel[i]**2 for i in range(2)))
-        if self.hook: self.hook.soldier_before_hit(self, explosion_dir, modified_damage, explosion_pos)
+        if self.dispatch.soldier_ss_detected: vspeed_before_explosion = self.vel[2]
+        if self.dispatch.soldier_before_hit: self.dispatch.soldier_before_hit(self, explosion_dir, modified_damage, explosion_pos)
         for i in range(3):
             self.vel[i] += explosion_dir[i] * modified_damage
-        if self.hook: self.hook.soldier_after_hit(self, explosion_dir, modified_damage, explosion_pos)
+        if self.dispatch.soldier_after_hit: self.dispatch.soldier_after_hit(self, explosion_dir, modified_damage, explosion_pos)
         
-        if self.hook:
+        if self.dispatch.soldier_ss_detected:
             hit_ss = self.b_on_ground and self.hook.landed_this_tick and self.vel[2] > 0.0 and vspeed_before_explosion == 0.0
-            if hit_ss: self.hook.soldier_ss_detected(self, explosion_dir, modified_damage, explosion_pos)
-        if self.hook and self.b_on_ground and 1.0 < self.pos[2] - self.floor.z <= 2.0 and self.vel[2] > 0.0: 
-            if self.b_ducked: self.hook.soldier_crouched_bounce_detected(self, explosion_dir, modified_damage, explosion_pos)
-            else: self.hook.soldier_standing_bounce_detected(self, explosion_dir, modified_damage, explosion_pos)
+            if hit_ss: self.dispatch.soldier_ss_detected(self, explosion_dir, modified_damage, explosion_pos)
+        if self.b_on_ground and 1.0 < self.pos[2] - self.floor.z <= 2.0 and self.vel[2] > 0.0: 
+            if self.b_ducked:
+                if self.dispatch.soldier_crouched_bounce_detected: self.dispatch.soldier_crouched_bounce_detected(self, explosion_dir, modified_damage, explosion_pos)
+            else:
+                if self.dispatch.soldier_standing_bounce_detected: self.dispatch.soldier_standing_bounce_detected(self, explosion_dir, modified_damage, explosion_pos)
@@ -0,0 +1,105 @@
+"""
+    Parameter sweeps over soldier scenarios.
+
+    A sweep runs one scenario for every point of a parameter grid, spread out
+    over a pool of processes. The grid is a dict of parameter name -> list of values,
+    and the scenario factory is called with one value for each parameter
+    (e.g. factory(angle=-89.0, fire_tick=5, floor_z=0.0)) and returns a Scenario.
+
+    Grid points are sent to the worker processes in chunks of chunk_size, to keep
+    the overhead of sending work and results between processes small. Results are
+    yielded as soon as their chunk is done, so they come back out of order.
+
+    Input scripts can be shared between the processes by saving them to a file,
+    and loading them with Input_script.load in the factory.
+
+    Note: The factory and the measure function are sent to the worker processes,
+          so they need to be picklable (i.e. defined at the top level of a module).
+          Also put the code starting the sweep under if __name__ == '__main__':
+
+    Example
+        def factory(angle, fire_tick):
+            p = simulation.Soldier(simulation.Key_state(), angle=angle)
+            inputs = [(fire_tick, '+attack', 1.0), (fire_tick + 1, '+attack', 0.0)]
+            return sweep.Scenario(p, inputs, ticks=200)
+
+        if __name__ == '__main__':
+            grid = {'angle' : [-89.0, -88.0, -87.0], 'fire_tick' : range(10)}
+            for index, params, result in sweep.sweep(factory, grid):
+                print(params, result)
+"""
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice, product
+import os
+
+from input_script import Input_script, Timeline
+
+# The default measurement of a finished run
+def summary(soldier):
+    return {
+        'pos' : list(soldier.pos),
+        'vel' : list(soldier.vel),
+        'b_on_ground' : soldier.b_on_ground,
+        'b_ducked' : soldier.b_ducked,
+    }
+
+class Scenario:
+    # inputs is an Input_script, a Timeline, or a list of (tick, key, value)
+    def __init__(self, soldier, inputs = (), ticks = 100, measure = summary):
+        self.soldier = soldier
+        self.inputs = inputs
+        self.ticks = ticks
+        self.measure = measure
+
+    def run(self):
+        timeline = self.inputs
+        if isinstance(timeline, Input_script):
+            timeline = timeline.compile()
+        elif not isinstance(timeline, Timeline):
+            timeline = Timeline(timeline)
+        timeline.run(self.soldier, self.ticks)
+        return self.measure(self.soldier)
+
+# All points of the grid, as dicts of parameter name -> value
+def grid_points(grid):
+    names = list(grid)
+    for values in product(*(grid[name] for name in names)):
+        yield dict(zip(names, values))
+
+def run_chunk(factory, chunk):
+    return [(index, params, factory(**params).run()) for index, params in chunk]
+
+def chunks(points, chunk_size):
+    points = enumerate(points)
+    while True:
+        chunk = list(islice(points, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+# Yields (index, params, result) for every point of the grid, in order of completion.
+# index is the position of the point in grid_points(grid). workers = 0 runs everything in this process.
+def sweep(factory, grid, workers = None, chunk_size = 64):
+    work = chunks(grid_points(grid), chunk_size)
+    if workers == 0:
+        for chunk in work:
+            yield from run_chunk(factory, chunk)
+        return
+
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        # Keep a few chunks queued up per worker, without submitting the whole grid at once
+        pending = {executor.submit(run_chunk, factory, chunk) for chunk in islice(work, 4 * workers)}
+        while pending:
+            done, pending = wait(pending, return_when = FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+                chunk = next(work, None)
+                if chunk is not None:
+                    pending.add(executor.submit(run_chunk, factory, chunk))
+
+# Same as sweep, but returns a list of (params, result) in grid order
+def sweep_list(factory, grid, workers = None, chunk_size = 64):
+    results = sorted(sweep(factory, grid, workers, chunk_size), key = lambda x: x[0])
+    return [(params, result) for _, params, result in results]
@@ -0,0 +1,98 @@
+"""
+    State hashing and transposition tables.
+
+    Many different input histories lead to the same state. state_hash gives a
+    canonical hash of everything that affects how a soldier moves from now on,
+    so that states that have already been simulated can be recognized.
+
+    The hash is canonical in the sense that
+      - Timers that have passed the point where they matter are clamped.
+        duck_animation above UNDUCKING_TIME counts as 10.0 (its default),
+        reduck_timer above REDUCK_TIME counts as REDUCK_TIME,
+        and fire_cooldown below 0.0 counts as 0.0
+      - Floors are compared by z, launchers by class and rockets by pos, vel and floor z
+        (not by rocket_id)
+      - With ignore_xy, the horizontal position is left out when there are no rockets
+        since floors are infinite
+
+    The hash is a 16 byte digest of the state. Unlike hash(), it is the same in every
+    process, so it can also be used to share results between the processes of a sweep.
+
+    Transposition_table is a bounded dict that throws out the least recently used entries.
+"""
+
+from collections import OrderedDict
+from hashlib import blake2b
+from struct import pack
+
+from simulation import available_keys, REDUCK_TIME, UNDUCKING_TIME
+
+sorted_keys = sorted(available_keys)
+
+# The state of the soldier as a list of floats, see state_hash
+def state_values(soldier, ignore_xy = False):
+    rockets = list(getattr(soldier, 'rocket_scheduler', ()))
+    values = list(soldier.pos) if rockets or not ignore_xy else [soldier.pos[2]]
+    values += soldier.vel
+    values += [
+        soldier.angle, soldier.b_ducked, soldier.b_ducking, soldier.b_on_ground, soldier.floor.z,
+    ]
+    values += soldier.forward_2D
+    values += soldier.right_2D
+    values += [
+        soldier.grip, soldier.b_crop_speed_ducking,
+        soldier.duck_animation if soldier.duck_animation <= UNDUCKING_TIME else 10.0,
+        min(soldier.reduck_timer, REDUCK_TIME),
+        soldier.b_prev_tick_duck_pressed, soldier.airduck_counter, soldier.b_prev_tick_jump_pressed,
+        soldier.z_eye_offset,
+        max(getattr(soldier, 'fire_cooldown', 0.0), 0.0),
+    ]
+    values += [soldier.key_state[key] for key in sorted_keys]
+    for rocket in rockets:
+        values += rocket.pos
+        values += rocket.vel
+        values.append(rocket.floor.z)
+    return values
+
+def state_hash(soldier, ignore_xy = False):
+    values = state_values(soldier, ignore_xy)
+    h = blake2b(pack('<%dd' % len(values), *values), digest_size = 16)
+    launcher = getattr(soldier, 'launcher', None)
+    if launcher is not None:
+        # The launcher can be given both as a class and as an instance
+        launcher_class = launcher if isinstance(launcher, type) else type(launcher)
+        h.update(launcher_class.__name__.encode())
+    return h.digest()
+
+class Transposition_table:
+    def __init__(self, max_size = 1000000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default = None):
+        entries = self.entries
+        if key in entries:
+            self.hits += 1
+            entries.move_to_end(key)
+            return entries[key]
+        self.misses += 1
+        return default
+
+    def __setitem__(self, key, value):
+        entries = self.entries
+        entries[key] = value
+        entries.move_to_end(key)
+        if len(entries) > self.max_size:
+            entries.popitem(last = False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
@@ -5,41 +5,44 @@
 import simulation
 
 
-def visualize(player_pos, rocket_positions = {}, rocket_explosions = {}):
-    import matplotlib.pyplot as plt
-    from mpl_toolkits.mplot3d import Axes3D
-    from matplotlib.animation import FuncAnimation
+# Keeps at most max_points points, evenly spread out. The first and last point are always kept.
+def decimate(points, max_points):
+    import numpy as np
+    points = np.asarray(points)
+    if max_points is None or len(points) <= max_points:
+        return points
+    keep = np.unique(np.linspace(0, len(points) - 1, max_points).round().astype(int))
+    return points[keep]
+
+# Draws the trajectory onto a 3D axes
+def draw(ax, player_pos, rocket_positions = {}, rocket_explosions = {}, max_points = None):
     import numpy as np
     from matplotlib.ticker import MultipleLocator
 
-    data = np.array(player_pos)
+    data = decimate(player_pos, max_points)
     px, py, pz = data[:,0], data[:,1], data[:,2]
 
-    # Set up the figure
-    fig = plt.figure()
-    ax = fig.add_subplot(111, projection='3d')
-
     # Set limits
     ax.set_xlim(min(px) - 1, max(px) + 1)
     ax.set_ylim(min(py) - 1, max(py) + 1)
     ax.set_zlim(min(pz) - 1, max(pz) + 1)
-    
+
     # Increase grid density
     ax.xaxis.set_major_locator(MultipleLocator(100))
     ax.yaxis.set_major_locator(MultipleLocator(100))
     ax.zaxis.set_major_locator(MultipleLocator(100))
     ax.grid(True)
-    
+
     ax.set_xlabel('X')
     ax.set_ylabel('Y')
     ax.set_zlabel('Z')
-    
+
     # Line showing path
     ax.plot(px, py, pz, color='lightgray', linewidth=1, marker='x')
     ax.set_aspect('equal')
-    
+
     for rocket_id in rocket_positions:
-        data = np.array(rocket_positions[rocket_id])
+        data = decimate(rocket_positions[rocket_id], max_points)
         x, y, z = data[:,0], data[:,1], data[:,2]
         ax.plot(x, y, z, color='blue', linewidth=1, marker='x')
 
@@ -49,7 +52,22 @@ def visualize(player_pos, rocket_positions = {}, rocket_explosions = {}):
 
 
     ax.view_init(azim=-90, elev=0)#, elev=30)
-    
+
+def visualize(player_pos, rocket_positions = {}, rocket_explosions = {}):
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d import Axes3D
+    from matplotlib.animation import FuncAnimation
+    import numpy as np
+
+    data = np.asarray(player_pos)
+    px, py, pz = data[:,0], data[:,1], data[:,2]
+
+    # Set up the figure
+    fig = plt.figure()
+    ax = fig.add_subplot(111, projection='3d')
+
+    draw(ax, player_pos, rocket_positions, rocket_explosions)
+
     # Moving ball
     ball, = ax.plot([], [], [], 'co', markersize=8)
 
@@ -67,3 +85,82 @@ def visualize(player_pos, rocket_positions = {}, rocket_explosions = {}):
                         interval=simulation.tick_duration*1000, blit=True, repeat=True)
 
     plt.show()
+
+
+# Visualize a single run of a recording made with recorder.Recorder_hook
+# ticks = (first, last) only shows first <= tick < last
+def visualize_recording(path, run = 0, ticks = None):
+    import recorder
+    visualize(*recorder.Recording(path).trajectory(run, ticks))
+
+
+"""
+    Headless rendering
+
+    These render to image files using matplotlib's Agg canvas directly,
+    so they work without a display (e.g. on CI) and never open any windows.
+    Trajectories are decimated to at most max_points points per line.
+"""
+
+def headless_figure(size, dpi):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from mpl_toolkits.mplot3d import Axes3D
+    fig = Figure(figsize=size, dpi=dpi)
+    FigureCanvasAgg(fig)
+    return fig
+
+# Renders the whole trajectory to a single image
+def render(path, player_pos, rocket_positions = {}, rocket_explosions = {}, max_points = 2000, size = (8, 6), dpi = 100, title = None):
+    fig = headless_figure(size, dpi)
+    ax = fig.add_subplot(111, projection='3d')
+    draw(ax, player_pos, rocket_positions, rocket_explosions, max_points)
+    if title is not None:
+        ax.set_title(title)
+    fig.savefig(path)
+
+# Renders an animation as numbered images frame_00000.png, ... in directory, e.g. to turn into a video.
+# At most max_frames frames are rendered, evenly spread out over the ticks.
+def render_frames(directory, player_pos, rocket_positions = {}, rocket_explosions = {}, max_frames = 200, max_points = 2000, size = (8, 6), dpi = 100):
+    import os
+    import numpy as np
+    os.makedirs(directory, exist_ok=True)
+
+    fig = headless_figure(size, dpi)
+    ax = fig.add_subplot(111, projection='3d')
+    draw(ax, player_pos, rocket_positions, rocket_explosions, max_points)
+    # Only the moving ball changes between frames
+    ball, = ax.plot([], [], [], 'co', markersize=8)
+
+    frames = decimate(np.asarray(player_pos), max_frames)
+    paths = []
+    for i, (x, y, z) in enumerate(frames):
+        ball.set_data([x], [y])
+        ball.set_3d_properties([z])
+        paths.append(os.path.join(directory, 'frame_%05d.png' % i))
+        fig.savefig(paths[-1])
+    return paths
+
+# Renders one image per run of a recording made with recorder.Recorder_hook, run_00000.png, ... in directory.
+# The same figure is reused for every run.
+def render_runs(directory, recording_path, runs = None, ticks = None, max_points = 2000, size = (8, 6), dpi = 100):
+    import os
+    import recorder
+    os.makedirs(directory, exist_ok=True)
+    recording = recorder.Recording(recording_path)
+    if runs is None:
+        runs = recording.runs()
+
+    fig = headless_figure(size, dpi)
+    paths = []
+    for run in runs:
+        player_pos, rocket_positions, rocket_explosions = recording.trajectory(run, ticks)
+        if not len(player_pos):
+            continue
+        fig.clear()
+        ax = fig.add_subplot(111, projection='3d')
+        draw(ax, player_pos, rocket_positions, rocket_explosions, max_points)
+        ax.set_title('run %d' % run)
+        paths.append(os.path.join(directory, 'run_%05d.png' % run))
+        fig.savefig(paths[-1])
+    return paths
@@ -0,0 +1,147 @@
+"""
+    A world with many soldiers.
+
+    The soldiers of a world share the floors and the rockets. Every explosion knocks back
+    every soldier within the explosion radius (using the bounding box distance, see
+    Soldier.simulate_knockback), not only the soldier that shot the rocket.
+
+    A tick of the world is
+        1. every soldier moves (Soldier.simulate_movement)
+        2. the rockets are updated, and explosions knock back the soldiers near them
+        3. every soldier updates its weapon and possibly shoots (Soldier.simulate_weapon)
+    which is the same order as in Soldier.simulate_tick. A world with a single soldier
+    therefore gives exactly the same result as simulating the soldier on its own.
+
+    Soldiers are put into a uniform grid (Spatial_index) before the rockets are updated,
+    so an explosion only looks at the soldiers in the nearby cells. Soldiers do not move
+    while the rockets are updated, knockback only changes their velocity.
+
+    Usage
+        world = World(floors = [0.0, 512.0])
+        a = world.add(simulation.Soldier(key_state_a, pos = [0.0, 0.0, 512.0]))
+        b = world.add(simulation.Soldier(key_state_b, pos = [100.0, 0.0, 0.0]))
+        for tick in range(400):
+            world.simulate_tick()
+
+    Note: soldier.rocket_scheduler is the shared scheduler of the world, use
+          world.rockets_of(soldier) for the rockets shot by a soldier.
+    Note: soldier_outside_explosion is only called for soldiers in the cells near the explosion.
+    Note: The profiler (see profiler.py) counts World.simulate_tick as a single tick, and the
+          rocket updates of the world as the phase world_update_rockets.
+"""
+
+from collections import defaultdict
+from itertools import product
+from math import floor
+
+import simulation
+
+class Spatial_index:
+    def __init__(self, cell_size = 256.0):
+        self.cell_size = cell_size
+        self.cells = {}
+        # Largest distance between the center and the bounding box of any soldier along each axis
+        self.extent = [0.0, 0.0, 0.0]
+
+    def cell(self, pos):
+        c = self.cell_size
+        return (floor(pos[0] / c), floor(pos[1] / c), floor(pos[2] / c))
+
+    # Soldiers are placed by the center of their standing bounding box.
+    # The ducked bounding box (in either position, see simulate_knockback) lies inside of it.
+    @staticmethod
+    def center(soldier):
+        return (soldier.pos[0], soldier.pos[1], soldier.pos[2] + soldier.standing_bounding_box[2] / 2)
+
+    def build(self, soldiers):
+        self.extent = [max((soldier.standing_bounding_box[i] / 2 for soldier in soldiers), default = 0.0) for i in range(3)]
+        cells = defaultdict(list)
+        for i, soldier in enumerate(soldiers):
+            cells[self.cell(self.center(soldier))].append(i)
+        self.cells = cells
+
+    # Indices of the soldiers whose bounding box might be within radius of pos, in increasing order
+    def near(self, pos, radius):
+        c = self.cell_size
+        ranges = []
+        for i in range(3):
+            reach = radius + self.extent[i]
+            ranges.append(range(floor((pos[i] - reach) / c), floor((pos[i] + reach) / c) + 1))
+        found = []
+        cells = self.cells
+        if len(cells) < len(ranges[0]) * len(ranges[1]) * len(ranges[2]):
+            # Fewer occupied cells than cells to look at
+            for key, indices in cells.items():
+                if all(key[i] in ranges[i] for i in range(3)):
+                    found += indices
+        else:
+            for key in product(*ranges):
+                found += cells.get(key, ())
+        found.sort()
+        return found
+
+class World:
+    def __init__(self, floors = (), cell_size = 256.0):
+        self.floors = []
+        for z in floors:
+            self.add_floor(z)
+        self.soldiers = []
+        self.rocket_scheduler = simulation.Rocket_scheduler()
+        # rocket_id -> the soldier that shot the rocket
+        self.owners = {}
+        self.index = Spatial_index(cell_size)
+
+    def add_floor(self, z):
+        floor = simulation.Floor(z)
+        self.floors.append(floor)
+        self.floors.sort(key = lambda floor: floor.z)
+        return floor
+
+    # The highest floor at or below z, None if there is none
+    def floor_at(self, z):
+        below = [floor for floor in self.floors if floor.z <= z]
+        return below[-1] if below else None
+
+    # Adds a soldier to the world. If the floor of the soldier is not one
+    # of the floors of the world, it is put on the highest floor below it.
+    def add(self, soldier):
+        if len(soldier.rocket_scheduler):
+            raise ValueError('soldiers can only be added to a world before they shoot any rockets')
+        if self.floors and soldier.floor not in self.floors:
+            floor = self.floor_at(soldier.pos[2])
+            if floor is not None:
+                soldier.floor = floor
+        soldier.rocket_scheduler = self.rocket_scheduler
+        self.soldiers.append(soldier)
+        return soldier
+
+    def rockets_of(self, soldier):
+        return [rocket for rocket in self.rocket_scheduler if self.owners.get(rocket.rocket_id) is soldier]
+
+    def simulate_tick(self):
+        for soldier in self.soldiers:
+            soldier.simulate_movement()
+        self.update_rockets()
+        for soldier in self.soldiers:
+            rocket = soldier.simulate_weapon()
+            if rocket is not None:
+                self.owners[rocket.rocket_id] = soldier
+            if soldier.dispatch.soldier_after_tick_update: soldier.dispatch.soldier_after_tick_update(soldier)
+
+    def update_rockets(self):
+        due = self.rocket_scheduler.due()
+        if due:
+            self.index.build(self.soldiers)
+        for rocket in due:
+            rocket_exploded, explosion_pos = rocket.simulate_tick()
+            if not rocket_exploded:
+                continue
+            self.rocket_scheduler.remove(rocket)
+            self.owners.pop(rocket.rocket_id, None)
+            self.explode(explosion_pos, rocket.explosion_damage, rocket.explosion_radius)
+        self.rocket_scheduler.finish_tick()
+
+    def explode(self, explosion_pos, explosion_damage, explosion_radius):
+        for i in self.index.near(explosion_pos, explosion_radius):
+            # simulate_knockback moves explosion_pos, so every soldier gets its own copy
+            self.soldiers[i].simulate_knockback(list(explosion_pos), explosion_damage, explosion_radius)